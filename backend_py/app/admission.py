@@ -0,0 +1,208 @@
+"""Admission control: per-route-class concurrency budgets with load shedding.
+
+Every request is classed as circulation (writes under `/api/borrowing` by
+a desk or admin token), write, read or upload. A request runs at once if its
+class is under its limit and the server is under `ADMISSION_TOTAL_LIMIT`.
+Otherwise it waits in a bounded queue. Freed slots go to waiters in
+priority order: circulation, then write, read, upload. A request is shed
+with `503 Retry-After` when its class queue is already full or it has
+waited `timeout` seconds. Overload then costs a fast rejection instead of
+piling more work on the SQLite writer.
+
+Limits can be tuned per class with `ADMISSION_<CLASS>_LIMIT`,
+`ADMISSION_<CLASS>_QUEUE` and `ADMISSION_<CLASS>_TIMEOUT`.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from .security import bearer_claims
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# long-lived streams and probes would otherwise hold a slot forever or get shed
+EXEMPT_PREFIXES = ("/api/health", "/api/events/books")
+UPLOAD_PATHS = ("/api/users/me/avatar",)
+UPLOAD_MIN_BYTES = int(os.getenv("ADMISSION_UPLOAD_MIN_BYTES", str(64 * 1024)))
+# AnyIO runs sync routes on a 40-thread pool. Admitting more than that only
+# moves the queue into the pool, where nothing is shed, so stay below it and
+# leave threads for exempt routes and auth dependencies.
+ADMISSION_TOTAL_LIMIT = int(os.getenv("ADMISSION_TOTAL_LIMIT", "32"))
+# token roles whose borrowing writes jump the queue; anyone else's are plain writes
+CIRCULATION_ROLES = frozenset(
+    r.strip() for r in os.getenv("ADMISSION_CIRCULATION_ROLES", "desk,admin").split(",") if r.strip()
+)
+
+@dataclass
+class RouteClass:
+    name: str
+    priority: int  # lower is served first
+    limit: int
+    queue: int
+    timeout: float
+
+    @classmethod
+    def from_env(cls, name: str, priority: int, limit: int, queue: int, timeout: float) -> "RouteClass":
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name=name,
+            priority=priority,
+            limit=int(os.getenv(prefix + "LIMIT", str(limit))),
+            queue=int(os.getenv(prefix + "QUEUE", str(queue))),
+            timeout=float(os.getenv(prefix + "TIMEOUT", str(timeout))),
+        )
+
+ROUTE_CLASSES = {
+    c.name: c for c in (
+        RouteClass.from_env("circulation", priority=0, limit=16, queue=256, timeout=10),
+        RouteClass.from_env("write", priority=1, limit=8, queue=64, timeout=5),
+        RouteClass.from_env("read", priority=2, limit=32, queue=128, timeout=2),
+        RouteClass.from_env("upload", priority=3, limit=2, queue=8, timeout=10),
+    )
+}
+
+def classify(method: str, path: str, headers: dict[bytes, bytes]) -> Optional[str]:
+    """Route class of a request, or None if it bypasses admission control"""
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if method in SAFE_METHODS:
+        return "read"
+    if path.startswith(UPLOAD_PATHS):
+        return "upload"
+    if headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+        length = headers.get(b"content-length", b"")
+        if not length.isdigit() or int(length) >= UPLOAD_MIN_BYTES:
+            return "upload"
+    if path.startswith("/api/borrowing/"):
+        # the signed role claim, read without a DB round trip
+        claims = bearer_claims(headers.items())
+        if claims and claims.get("role") in CIRCULATION_ROLES:
+            return "circulation"
+    return "write"
+
+class Overloaded(Exception):
+    pass
+
+class AdmissionController:
+    """Slot accounting for one event loop; not thread safe, and needs no lock"""
+
+    def __init__(self, classes: dict[str, RouteClass], total: int):
+        self.classes = classes
+        self.total = total
+        self.active = {name: 0 for name in classes}
+        self.waiting = {name: 0 for name in classes}
+        self.shed = {name: 0 for name in classes}
+        self._running = 0
+        self._waiters: list[tuple[int, int, asyncio.Future, RouteClass]] = []
+        self._seq = itertools.count()
+
+    def _fits(self, cls: RouteClass) -> bool:
+        return self._running < self.total and self.active[cls.name] < cls.limit
+
+    def _grant(self, cls: RouteClass):
+        self._running += 1
+        self.active[cls.name] += 1
+
+    def _has_priority_waiter(self, cls: RouteClass) -> bool:
+        # a free slot is taken by an earlier or higher priority waiter that fits
+        return any(p <= cls.priority and not f.done() and self._fits(c) for p, _, f, c in self._waiters)
+
+    async def acquire(self, cls: RouteClass):
+        if self._fits(cls) and not self._has_priority_waiter(cls):
+            self._grant(cls)
+            return
+        if self.waiting[cls.name] >= cls.queue:
+            self.shed[cls.name] += 1
+            raise Overloaded()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (cls.priority, next(self._seq), fut, cls))
+        self.waiting[cls.name] += 1
+        try:
+            await asyncio.wait_for(fut, cls.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # the slot was granted just as we gave up: hand it back
+                self.release(cls)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.shed[cls.name] += 1
+            raise Overloaded()
+        finally:
+            self.waiting[cls.name] -= 1
+
+    def release(self, cls: RouteClass):
+        self._running -= 1
+        self.active[cls.name] -= 1
+        self._wake()
+
+    def _wake(self):
+        skipped = []
+        while self._waiters and self._running < self.total:
+            entry = heapq.heappop(self._waiters)
+            _, _, fut, cls = entry
+            if fut.done():  # timed out or disconnected
+                continue
+            if self.active[cls.name] >= cls.limit:
+                skipped.append(entry)
+                continue
+            self._grant(cls)
+            fut.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def stats(self) -> dict:
+        return {
+            "total_limit": self.total,
+            "running": self._running,
+            "classes": {
+                name: {
+                    "limit": cls.limit, "queue": cls.queue, "active": self.active[name],
+                    "waiting": self.waiting[name], "shed": self.shed[name],
+                }
+                for name, cls in self.classes.items()
+            },
+        }
+
+controller = AdmissionController(ROUTE_CLASSES, ADMISSION_TOTAL_LIMIT)
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController = controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = classify(scope["method"], scope["path"], dict(scope.get("headers", [])))
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        cls = self.controller.classes[name]
+        try:
+            await self.controller.acquire(cls)
+        except Overloaded:
+            await self._shed(send, cls)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(cls)
+
+    @staticmethod
+    async def _shed(send, cls: RouteClass):
+        body = json.dumps({"detail": "Server busy, try again"}).encode()
+        retry_after = str(max(1, round(cls.timeout / 2)))
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry_after.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,225 @@
+"""Circulation analytics from daily rollup tables.
+
+Every borrow and return adds to four rollups (per day, per day and
+category, per day and book, per month and book) in the same transaction as
+the loan change, so reports never aggregate raw borrowing history. Top-book
+reports read the monthly rows for whole months in the range and daily rows
+only for the partial months at either end.
+
+Rebuild the rollups from the borrowing table (e.g. for data that predates
+them) with:
+
+    python -m app.analytics rebuild [--branch <branch>]
+"""
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, func, or_, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+UNCATEGORIZED = "uncategorized"
+COUNTERS = ("borrows", "returns", "loan_seconds")
+# per-book rollups and their period column
+BOOK_ROLLUPS = ((models.DailyBookCirculation, "day"), (models.MonthlyBookCirculation, "month"))
+ROLLUPS = (models.DailyCirculation, models.DailyCategoryCirculation) + tuple(m for m, _ in BOOK_ROLLUPS)
+
+def _upsert(db: Session, model, keys: tuple[str, ...], deltas: dict[tuple, list[int]]):
+    """Add `deltas` ({key values: [borrows, returns, loan_seconds]}) onto the rollup rows"""
+    if not deltas:
+        return
+    insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else pg_insert
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={c: getattr(model, c) + getattr(stmt.excluded, c) for c in COUNTERS},
+    )
+    db.execute(stmt, [
+        {**dict(zip(keys, key)), **dict(zip(COUNTERS, counts))}
+        for key, counts in deltas.items()
+    ])
+
+def record(
+    db: Session,
+    borrows: Iterable[tuple[int, Optional[str], datetime]] = (),
+    returns: Iterable[tuple[int, Optional[str], datetime, datetime]] = (),
+):
+    """Fold loan events into the rollups; call before the transaction commits.
+
+    borrows: (book_id, category, borrowed_at)
+    returns: (book_id, category, borrowed_at, returned_at)
+    """
+    by_day: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+    by_category: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+    by_book: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+    by_book_month: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+
+    def add(day: date, book_id: int, category: Optional[str], counts: tuple[int, int, int]):
+        for rollup, key in (
+            (by_day, (day,)),
+            (by_category, (day, category or UNCATEGORIZED)),
+            (by_book, (day, book_id)),
+            (by_book_month, (period_start(day, "month"), book_id)),
+        ):
+            row = rollup[key]
+            for i, n in enumerate(counts):
+                row[i] += n
+
+    for book_id, category, borrowed_at in borrows:
+        add(borrowed_at.date(), book_id, category, (1, 0, 0))
+    for book_id, category, borrowed_at, returned_at in returns:
+        seconds = max(0, int((returned_at - borrowed_at).total_seconds()))
+        add(returned_at.date(), book_id, category, (0, 1, seconds))
+
+    _upsert(db, models.DailyCirculation, ("day",), by_day)
+    _upsert(db, models.DailyCategoryCirculation, ("day", "category"), by_category)
+    _upsert(db, models.DailyBookCirculation, ("day", "book_id"), by_book)
+    _upsert(db, models.MonthlyBookCirculation, ("month", "book_id"), by_book_month)
+
+def merge_books(db: Session, moved: dict[int, int]):
+    """Fold the per-book rollups of merged books ({old id: new id}) into the
+    surviving books' rows; call inside the merging transaction"""
+    for m, period in BOOK_ROLLUPS:
+        deltas: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+        for start, book_id, *counts in db.query(
+            getattr(m, period), m.book_id, *(getattr(m, c) for c in COUNTERS)
+        ).filter(m.book_id.in_(list(moved))):
+            row = deltas[(start, moved[book_id])]
+            for i, n in enumerate(counts):
+                row[i] += n
+        db.execute(delete(m).where(m.book_id.in_(list(moved))), execution_options={"synchronize_session": False})
+        _upsert(db, m, (period, "book_id"), deltas)
+
+def fill_monthly(db: Session):
+    """Derive the monthly per-book rollup from the daily one, for databases
+    that predate it; call inside a transaction"""
+    m = models.DailyBookCirculation
+    deltas: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+    for day, book_id, *counts in db.query(m.day, m.book_id, *(getattr(m, c) for c in COUNTERS)):
+        row = deltas[(period_start(day, "month"), book_id)]
+        for i, n in enumerate(counts):
+            row[i] += n
+    _upsert(db, models.MonthlyBookCirculation, ("month", "book_id"), deltas)
+
+def rebuild(db: Session):
+    """Recompute every rollup from the borrowing table, in one transaction"""
+    for model in ROLLUPS:
+        db.execute(delete(model))
+    loans = db.query(
+        models.Borrowing.book_id, models.Book.category, models.Borrowing.borrow_date,
+        models.Borrowing.return_date, models.Borrowing.status,
+    ).outerjoin(models.Book, models.Book.id == models.Borrowing.book_id).all()
+    record(
+        db,
+        borrows=((b, c, borrowed) for b, c, borrowed, _, _ in loans if borrowed),
+        returns=(
+            (b, c, borrowed, returned) for b, c, borrowed, returned, status in loans
+            if status == "returned" and borrowed and returned
+        ),
+    )
+    db.commit()
+
+def avg_loan_days(returns: int, loan_seconds: int) -> Optional[float]:
+    return round(loan_seconds / returns / 86400, 2) if returns else None
+
+def period_start(day: date, interval: str) -> date:
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    return day
+
+def _totals(model):
+    return func.sum(model.borrows), func.sum(model.returns), func.sum(model.loan_seconds)
+
+def summary(db: Session, start: date, end: date) -> dict:
+    m = models.DailyCirculation
+    borrows, returns, seconds = db.query(*_totals(m)).filter(m.day.between(start, end)).one()
+    return {
+        "start": start, "end": end, "borrows": borrows or 0, "returns": returns or 0,
+        "avg_loan_days": avg_loan_days(returns or 0, seconds or 0),
+    }
+
+def daily(db: Session, start: date, end: date) -> list[dict]:
+    m = models.DailyCirculation
+    return [
+        {"day": r.day, "borrows": r.borrows, "returns": r.returns,
+         "avg_loan_days": avg_loan_days(r.returns, r.loan_seconds)}
+        for r in db.query(m).filter(m.day.between(start, end)).order_by(m.day)
+    ]
+
+def by_category(db: Session, start: date, end: date, interval: str = "week") -> list[dict]:
+    m = models.DailyCategoryCirculation
+    buckets: dict[tuple[date, str], list[int]] = defaultdict(lambda: [0, 0, 0])
+    for day, category, borrows, returns, seconds in db.query(
+        m.day, m.category, m.borrows, m.returns, m.loan_seconds
+    ).filter(m.day.between(start, end)):
+        row = buckets[(period_start(day, interval), category)]
+        row[0] += borrows
+        row[1] += returns
+        row[2] += seconds
+    return [
+        {"period": period, "category": category, "borrows": b, "returns": r,
+         "avg_loan_days": avg_loan_days(r, s)}
+        for (period, category), (b, r, s) in sorted(buckets.items())
+    ]
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def _book_rows(start: date, end: date):
+    """Per-book counter rows covering [start, end]: monthly rows for the whole
+    months inside it, daily rows for the days outside those"""
+    d, mo = models.DailyBookCirculation, models.MonthlyBookCirculation
+    first = start if start.day == 1 else _next_month(start)
+    stop = period_start(end + timedelta(days=1), "month")  # first month not wholly inside
+    daily_rows = select(d.book_id, d.borrows, d.returns, d.loan_seconds)
+    if first >= stop:
+        return daily_rows.where(d.day.between(start, end))
+    return union_all(
+        select(mo.book_id, mo.borrows, mo.returns, mo.loan_seconds).where(mo.month >= first, mo.month < stop),
+        daily_rows.where(or_(
+            d.day.between(start, first - timedelta(days=1)),
+            d.day.between(stop, end),
+        )),
+    )
+
+def top_books(db: Session, start: date, end: date, limit: int = 20, by: str = "borrows") -> list[dict]:
+    m = _book_rows(start, end).subquery()
+    borrows, returns, seconds = (t.label(c) for t, c in zip(_totals(m.c), COUNTERS))
+    ranked = (
+        db.query(m.c.book_id, borrows, returns, seconds)
+        .group_by(m.c.book_id)
+        .order_by((returns if by == "returns" else borrows).desc(), m.c.book_id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = db.query(ranked, models.Book.title, models.Book.author).outerjoin(
+        models.Book, models.Book.id == ranked.c.book_id
+    ).order_by(getattr(ranked.c, by).desc(), ranked.c.book_id)
+    return [
+        {"book_id": r.book_id, "title": r.title, "author": r.author, "borrows": r.borrows,
+         "returns": r.returns, "avg_loan_days": avg_loan_days(r.returns, r.loan_seconds)}
+        for r in rows
+    ]
+
+if __name__ == "__main__":
+    from .db import DEFAULT_BRANCH, sessions
+
+    args = sys.argv[1:]
+    if not args or args[0] != "rebuild":
+        sys.exit("usage: python -m app.analytics rebuild [--branch <branch>]")
+    branch = args[args.index("--branch") + 1] if "--branch" in args[:-1] else DEFAULT_BRANCH
+    if branch not in sessions:
+        sys.exit(f"unknown branch: {branch}")
+    session = sessions[branch]()
+    try:
+        rebuild(session)
+    finally:
+        session.close()
+    print(f"rebuilt circulation rollups for branch {branch}")
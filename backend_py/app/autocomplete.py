@@ -0,0 +1,426 @@
+"""Typo-tolerant title/author autocomplete over an in-memory index.
+
+Normalized titles and authors are concatenated into one bytes blob. Every
+word start in the blob is a key, and the key offsets are kept sorted in flat
+`array`s, so a prefix lookup is two binary searches. This is the array form
+of a prefix trie, and a 1M-title catalog costs a few bytes per key instead of
+a node object per character. The best suggestions for every prefix up to
+PRECOMPUTED_PREFIX_LEN bytes are precomputed. Longer prefixes pick the best of
+at most SCAN_LIMIT keys by a one-byte coarse rank kept per key, using bytes
+searches instead of a Python loop over the window; keys tied on that byte
+are ordered by their position in the full rank order, also kept per key.
+Lengths are UTF-8 byte lengths in the snapshot and the delta alike.
+
+Typos are handled by correcting query words against a trigram index over
+the vocabulary. Writes go to a small sorted delta plus a tombstone set.
+Once the delta passes DELTA_LIMIT books it is merged into a fresh snapshot
+on a background thread.
+"""
+import heapq
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+PRECOMPUTED_PREFIX_LEN = 3
+PRECOMPUTED_TOP = 32  # kept per prefix so dedupe and tombstones still leave enough
+SCAN_LIMIT = 4096
+DELTA_LIMIT = 5000
+MAX_POSTING = 20000  # trigrams more common than this are skipped for typo matching
+
+TITLE, AUTHOR = 0, 1
+SEP = b"\x00"
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents, and collapse punctuation/whitespace to single spaces"""
+    text = text or ""
+    if not text.isascii():
+        text = "".join(
+            ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch)
+        )
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+def normalize_query(q: str) -> str:
+    norm = normalize(q)
+    # a trailing space means the last word is complete
+    if norm and q[-1:].isspace():
+        norm += " "
+    return norm
+
+def _trigrams(word: str, complete: bool = True) -> set[str]:
+    padded = "  " + word + (" " if complete else "")
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _rank(kind: int, word_start: bool, length: int, book_id: int) -> tuple:
+    # whole-title matches first, then whole author, then inner words; shorter
+    # (in UTF-8 bytes) first, then lower book id
+    return (kind + (2 if word_start else 0), length, book_id)
+
+def _rank_byte(kind: int, word_start: bool, length: int) -> int:
+    """_rank without the book id, with lengths past 63 bytes tied, in one byte"""
+    return (kind + (2 if word_start else 0)) << 6 | min(length, 63)
+
+class _Snapshot:
+    """Immutable compact index over a set of (book id, title, author)"""
+
+    def __init__(self, docs: Iterable[tuple[int, str, str]]):
+        parts = []
+        offset = 0
+        self.field_start = array("I")
+        self.field_end = array("I")
+        self.field_book = array("I")
+        self.field_kind = array("B")
+        key_pos = array("I")
+        key_field = array("I")
+        for book_id, title, author in docs:
+            for kind, text in ((TITLE, title), (AUTHOR, author)):
+                if not text:
+                    continue
+                data = text.encode("utf-8")
+                field = len(self.field_book)
+                self.field_start.append(offset)
+                self.field_end.append(offset + len(data))
+                self.field_book.append(book_id)
+                self.field_kind.append(kind)
+                key_pos.append(offset)
+                key_field.append(field)
+                for i, byte in enumerate(data):
+                    if byte == 0x20:
+                        key_pos.append(offset + i + 1)
+                        key_field.append(field)
+                parts.append(data)
+                parts.append(SEP)
+                offset += len(data) + 1
+        self.blob = b"".join(parts)
+
+        blob, ends = self.blob, self.field_end
+        order = sorted(range(len(key_pos)), key=lambda i: blob[key_pos[i]:ends[key_field[i]]])
+        self.key_pos = array("I", (key_pos[i] for i in order))
+        self.key_field = array("I", (key_field[i] for i in order))
+        del order, key_pos, key_field
+        self.key_rank = bytes(
+            _rank_byte(self.field_kind[f], p != self.field_start[f], self.field_end[f] - self.field_start[f])
+            for p, f in zip(self.key_pos, self.key_field)
+        )
+        # each key's place in the full rank order, to break ties on key_rank
+        self.key_ordinal = array("I", [0]) * len(self.key_pos)
+        for ordinal, i in enumerate(sorted(range(len(self.key_pos)), key=self.rank)):
+            self.key_ordinal[i] = ordinal
+        self.top = self._precompute()
+
+    def __len__(self) -> int:
+        return len(self.key_pos)
+
+    def rank(self, i: int) -> tuple:
+        f = self.key_field[i]
+        start = self.field_start[f]
+        return _rank(self.field_kind[f], self.key_pos[i] != start,
+                     self.field_end[f] - start, self.field_book[f])
+
+    def _precompute(self) -> dict[bytes, array]:
+        """Best keys for every prefix up to PRECOMPUTED_PREFIX_LEN bytes.
+
+        One pass over the sorted keys groups them by their longest prefix;
+        shorter prefixes are then merged from their children's lists.
+        """
+        blob, pos, n = self.blob, self.key_pos, PRECOMPUTED_PREFIX_LEN
+        top: dict[bytes, array] = {}
+        current, group = None, []
+        for i in range(len(pos)):
+            prefix = blob[pos[i]:pos[i] + n].split(SEP, 1)[0]
+            if prefix != current:
+                if group:
+                    top[current] = self._best_of(group)
+                current, group = prefix, []
+            group.append(i)
+        if group:
+            top[current] = self._best_of(group)
+
+        for length in range(n - 1, 0, -1):
+            groups: dict[bytes, list] = {}
+            for prefix, keys in top.items():
+                if len(prefix) == length + 1:
+                    groups.setdefault(prefix[:length], []).extend(keys)
+            for prefix, keys in groups.items():
+                keys.extend(top.get(prefix, ()))
+                top[prefix] = self._best_of(set(keys))
+        return top
+
+    def key_range(self, prefix: bytes) -> tuple[int, int]:
+        blob, pos, n = self.blob, self.key_pos, len(prefix)
+        def key(i):
+            return blob[pos[i]:pos[i] + n]
+        lo = bisect_left(range(len(pos)), prefix, key=key)
+        hi = bisect_right(range(len(pos)), prefix, lo=lo, key=key)
+        return lo, hi
+
+    def _best_of(self, keys) -> array:
+        return array("I", sorted(keys, key=self.key_ordinal.__getitem__)[:PRECOMPUTED_TOP])
+
+    def search(self, prefix: bytes) -> list[int]:
+        """Key indices matching `prefix`, best first"""
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTED_PREFIX_LEN and prefix in self.top:
+            return list(self.top[prefix])
+        lo, hi = self.key_range(prefix)
+        return self._best(lo, min(hi, lo + SCAN_LIMIT))
+
+    def _best(self, lo: int, hi: int) -> list[int]:
+        """The PRECOMPUTED_TOP best keys in [lo, hi), best first"""
+        window = self.key_rank[lo:hi]
+        best = []
+        for value in sorted(set(window)):
+            tied = []
+            at = window.find(value)
+            while at != -1:
+                tied.append(lo + at)
+                at = window.find(value, at + 1)
+            tied.sort(key=self.key_ordinal.__getitem__)
+            best.extend(tied[:PRECOMPUTED_TOP - len(best)])
+            if len(best) == PRECOMPUTED_TOP:
+                break
+        return best
+
+    def has_prefix(self, prefix: bytes) -> bool:
+        lo, hi = self.key_range(prefix)
+        return hi > lo
+
+    def docs(self) -> Iterable[tuple[int, str, str]]:
+        fields: dict[int, list] = {}
+        for f in range(len(self.field_book)):
+            text = self.blob[self.field_start[f]:self.field_end[f]].decode("utf-8")
+            fields.setdefault(self.field_book[f], ["", ""])[self.field_kind[f]] = text
+        for book_id, (title, author) in fields.items():
+            yield book_id, title, author
+
+    def memory(self) -> dict[str, int]:
+        arrays = (self.key_pos, self.key_field, self.key_ordinal,
+                  self.field_start, self.field_end, self.field_book, self.field_kind)
+        top = sys.getsizeof(self.top) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.top.items()
+        )
+        return {
+            "blob": sys.getsizeof(self.blob),
+            "keys": sum(a.itemsize * len(a) for a in arrays[:3]) + len(self.key_rank),
+            "fields": sum(a.itemsize * len(a) for a in arrays[3:]),
+            "precomputed": top,
+        }
+
+class _Vocabulary:
+    """Trigram index over distinct words, for correcting misspelled query words"""
+
+    def __init__(self):
+        self.words: list[str] = []
+        self.ids: dict[str, int] = {}
+        self.postings: dict[str, array] = {}
+
+    def add(self, text: str):
+        for word in text.split():
+            if word in self.ids:
+                continue
+            wid = len(self.words)
+            self.ids[word] = wid
+            self.words.append(word)
+            for gram in _trigrams(word):
+                self.postings.setdefault(gram, array("I")).append(wid)
+
+    def correct(self, word: str, complete: bool) -> Optional[str]:
+        grams = _trigrams(word, complete)
+        counts: Counter = Counter()
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is not None and len(posting) <= MAX_POSTING:
+                counts.update(posting)
+        best, best_score = None, 0.0
+        for wid, _ in counts.most_common(50):
+            candidate = self.words[wid]
+            target = candidate if complete else candidate[:len(word) + 1]
+            other = _trigrams(target, complete)
+            shared = len(grams & other)
+            score = 2 * shared / (len(grams) + len(other))
+            if score > best_score:
+                best, best_score = candidate, score
+        return best if best_score >= 0.45 else None
+
+    def memory(self) -> int:
+        return (
+            sys.getsizeof(self.words) + sum(sys.getsizeof(w) for w in self.words)
+            + sys.getsizeof(self.ids)
+            + sys.getsizeof(self.postings)
+            + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.postings.items())
+        )
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot(())
+        self._vocab = _Vocabulary()
+        self._delta_docs: dict[int, tuple[str, str]] = {}
+        self._delta_keys: list[tuple[bytes, tuple, int]] = []  # (key, rank, book id)
+        self._tombstones: set[int] = set()
+        self._pending: Optional[list] = None  # writes made while a merge runs
+
+    def rebuild(self, db: Session):
+        rows = db.query(models.Book.id, models.Book.title, models.Book.author).all()
+        self.build((book_id, title, author) for book_id, title, author in rows)
+
+    def build(self, docs: Iterable[tuple[int, str, str]]):
+        vocab = _Vocabulary()
+        normalized = []
+        for book_id, title, author in docs:
+            title, author = normalize(title), normalize(author)
+            vocab.add(title)
+            vocab.add(author)
+            normalized.append((book_id, title, author))
+        snapshot = _Snapshot(normalized)
+        with self._lock:
+            self._snapshot, self._vocab = snapshot, vocab
+            self._delta_docs, self._delta_keys, self._tombstones = {}, [], set()
+
+    # writes
+    def add(self, book_id: int, title: str, author: str):
+        with self._lock:
+            self._apply_add(book_id, normalize(title), normalize(author))
+        self._maybe_merge()
+
+    def update(self, book_id: int, title: str, author: str):
+        with self._lock:
+            self._apply_remove(book_id)
+            self._apply_add(book_id, normalize(title), normalize(author))
+        self._maybe_merge()
+
+    def remove(self, book_id: int):
+        with self._lock:
+            self._apply_remove(book_id)
+
+    def _apply_add(self, book_id: int, title: str, author: str):
+        self._delta_docs[book_id] = (title, author)
+        self._vocab.add(title)
+        self._vocab.add(author)
+        for kind, text in ((TITLE, title), (AUTHOR, author)):
+            data = text.encode("utf-8")
+            for i in range(len(data)):
+                if i == 0 or data[i - 1] == 0x20:
+                    rank = _rank(kind, i > 0, len(data), book_id)
+                    insort(self._delta_keys, (data[i:], rank, book_id))
+        if self._pending is not None:
+            self._pending.append((book_id, title, author))
+
+    def _apply_remove(self, book_id: int):
+        self._tombstones.add(book_id)
+        if self._delta_docs.pop(book_id, None) is not None:
+            self._delta_keys = [k for k in self._delta_keys if k[2] != book_id]
+        if self._pending is not None:
+            self._pending.append((book_id, None, None))
+
+    def _maybe_merge(self):
+        with self._lock:
+            if self._pending is not None or len(self._delta_docs) < DELTA_LIMIT:
+                return
+            self._pending = []
+            base, tombstones = self._snapshot, set(self._tombstones)
+            delta = dict(self._delta_docs)
+        threading.Thread(target=self._merge, args=(base, tombstones, delta), daemon=True).start()
+
+    def _merge(self, base: _Snapshot, tombstones: set[int], delta: dict[int, tuple[str, str]]):
+        docs = [d for d in base.docs() if d[0] not in tombstones]
+        docs.extend((book_id, title, author) for book_id, (title, author) in delta.items())
+        snapshot = _Snapshot(docs)
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._snapshot = snapshot
+            self._delta_docs, self._delta_keys, self._tombstones = {}, [], set()
+            # replay writes that arrived while the merge was running
+            for book_id, title, author in pending:
+                self._apply_remove(book_id)
+                if title is not None:
+                    self._apply_add(book_id, title, author)
+
+    # reads
+    def _lookup(self, prefix: bytes, limit: int, seen: dict[int, int]):
+        with self._lock:
+            snapshot, tombstones = self._snapshot, set(self._tombstones)
+            lo = bisect_left(self._delta_keys, (prefix,))
+            delta = []
+            for key, rank, book_id in self._delta_keys[lo:lo + SCAN_LIMIT]:
+                if not key.startswith(prefix):
+                    break
+                delta.append((rank, book_id))
+        candidates = [
+            (snapshot.rank(i), snapshot.field_book[snapshot.key_field[i]])
+            for i in snapshot.search(prefix)
+        ]
+        candidates = [c for c in candidates if c[1] not in tombstones]
+        for rank, book_id in heapq.merge(sorted(candidates), sorted(delta)):
+            if len(seen) >= limit:
+                break
+            if book_id not in seen:
+                seen[book_id] = AUTHOR if rank[0] % 2 else TITLE
+
+    def _has_prefix(self, prefix: bytes) -> bool:
+        if self._snapshot.has_prefix(prefix):
+            return True
+        with self._lock:
+            lo = bisect_left(self._delta_keys, (prefix,))
+            return lo < len(self._delta_keys) and self._delta_keys[lo][0].startswith(prefix)
+
+    def suggest(self, q: str, limit: int = 10) -> list[tuple[int, int]]:
+        """(book id, TITLE|AUTHOR) pairs for the best matches of `q`"""
+        query = normalize_query(q)
+        if not query:
+            return []
+        seen: dict[int, int] = {}
+        self._lookup(query.encode("utf-8"), limit, seen)
+        if len(seen) < limit:
+            corrected = self._correct(query)
+            if corrected and corrected != query:
+                self._lookup(corrected.encode("utf-8"), limit, seen)
+        return list(seen.items())
+
+    def _correct(self, query: str) -> Optional[str]:
+        complete_last = query.endswith(" ")
+        words = query.split()
+        fixed = []
+        for n, word in enumerate(words):
+            complete = complete_last or n < len(words) - 1
+            known = word in self._vocab.ids if complete else self._has_prefix(word.encode("utf-8"))
+            if not known:
+                word = self._vocab.correct(word, complete) or word
+            fixed.append(word)
+        return " ".join(fixed) + (" " if complete_last else "")
+
+    def stats(self) -> dict[str, int]:
+        """Approximate memory budget in bytes, per structure"""
+        with self._lock:
+            snapshot = self._snapshot
+            report = dict(snapshot.memory())
+            report["vocabulary"] = self._vocab.memory()
+            report["delta"] = sys.getsizeof(self._delta_keys) + sum(
+                sys.getsizeof(k) + sys.getsizeof(r) for k, r, _ in self._delta_keys
+            )
+            report["total"] = sum(report.values())
+            report["keys_count"] = len(snapshot)
+            report["books_count"] = len(set(snapshot.field_book)) + len(self._delta_docs)
+        return report
+
+# book ids are per branch database, so each branch gets its own index
+_indexes: dict[str, AutocompleteIndex] = {}
+_indexes_lock = threading.Lock()
+
+def index_for(branch: str) -> AutocompleteIndex:
+    with _indexes_lock:
+        index = _indexes.get(branch)
+        if index is None:
+            index = _indexes[branch] = AutocompleteIndex()
+        return index
@@ -0,0 +1,79 @@
+"""Branch routing and branch data moves.
+
+Requests pick a branch either by URL, `/api/branches/<branch>/books/...`
+being served as `/api/books/...` against that branch's database, or by the
+`branch` claim of their bearer token. Without either they use the default
+branch.
+
+Copy a branch's database to a new file (online, consistent snapshot) with:
+
+    python -m app.branches copy <branch> <dest.db>
+
+then point the branch at it with `LIBRARY_BRANCHES=...,<branch>=<dest.db>`.
+"""
+import sqlite3
+import sys
+from typing import Optional
+
+from sqlalchemy.engine import make_url
+
+from .db import BRANCH_URLS, engines
+from .security import bearer_claims
+
+BRANCH_PREFIX = "/api/branches/"
+
+def _token_branch(headers: list[tuple[bytes, bytes]]) -> Optional[str]:
+    claims = bearer_claims(headers)
+    return claims.get("branch") if claims else None
+
+class BranchMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            branch = None
+            path = scope["path"]
+            if path.startswith(BRANCH_PREFIX):
+                branch, sep, rest = path[len(BRANCH_PREFIX):].partition("/")
+                if sep and branch:
+                    scope = dict(scope)
+                    scope["path"] = "/api/" + rest
+                    scope["raw_path"] = scope["path"].encode("utf-8")
+                else:
+                    branch = None
+            if branch is None:
+                branch = _token_branch(scope.get("headers", []))
+            if branch is not None:
+                scope.setdefault("state", {})["branch"] = branch
+        await self.app(scope, receive, send)
+
+def copy_branch(branch: str, dest: str):
+    """Snapshot a branch database into `dest` with SQLite's online backup API"""
+    if engines[branch].dialect.name != "sqlite":
+        raise ValueError(f"branch {branch} is not on SQLite; use the server's own dump/restore")
+    source = engines[branch].raw_connection()
+    target = sqlite3.connect(dest)
+    try:
+        source.driver_connection.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) != 3 or args[0] != "copy":
+        print("usage: python -m app.branches copy <branch> <dest.db>")
+        print("branches: " + ", ".join(f"{b} ({make_url(u).database})" for b, u in BRANCH_URLS.items()))
+        sys.exit(2)
+    _, branch, dest = args
+    if branch not in engines:
+        print(f"unknown branch: {branch}")
+        sys.exit(1)
+    try:
+        copy_branch(branch, dest)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"copied {branch} ({make_url(BRANCH_URLS[branch]).database}) -> {dest}")
+    print(f"serve it from there with LIBRARY_BRANCHES=...,{branch}={dest}")
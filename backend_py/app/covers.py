@@ -0,0 +1,286 @@
+"""Local disk cache for remote book cover images.
+
+A remote cover is fetched once and kept as `<key>.orig`. Each resized
+variant is kept as `<key>_<width>.<webp|jpg>`. The key is a hash of the
+image URL, so changing `Book.image` naturally misses the cache. Files are
+evicted least-recently-used once the directory passes `max_bytes`.
+Concurrent misses for the same variant share a single fetch/resize.
+
+Covers are only fetched from public addresses: every connection, including
+redirects, is checked after DNS resolution, so loopback, private and
+link-local hosts are refused unless listed in `COVER_ALLOWED_HOSTS`. Only
+responses that are images by both Content-Type and content are stored.
+"""
+import asyncio
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import threading
+import urllib.request
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from PIL import Image
+except ImportError:  # optional dependency; originals are served unresized
+    Image = None
+
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", os.path.join("cache", "covers"))
+COVER_CACHE_MAX_BYTES = int(os.getenv("COVER_CACHE_MAX_BYTES", str(256 * 2**20)))
+WIDTHS = (160, 320, 480, 640)
+DEFAULT_WIDTH = 320
+FETCH_TIMEOUT = 10
+MAX_REMOTE_BYTES = 10 * 2**20
+MAX_PIXELS = 40_000_000
+# image hosts on internal addresses that covers may still be fetched from
+ALLOWED_HOSTS = frozenset(h.strip().lower() for h in os.getenv("COVER_ALLOWED_HOSTS", "").split(",") if h.strip())
+
+class CoverFetchError(Exception):
+    pass
+
+def cover_key(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:20]
+
+def snap_width(width: Optional[int]) -> int:
+    """Round a requested width up to one of the cached variant widths"""
+    if not width:
+        return DEFAULT_WIDTH
+    return next((w for w in WIDTHS if w >= width), WIDTHS[-1])
+
+def sniff_media_type(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+def is_public_address(ip: ipaddress._BaseAddress) -> bool:
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection that refuses non-public addresses.
+
+    Checking the resolved addresses right where the socket is opened covers
+    redirects and hosts whose DNS changes between lookups alike.
+    """
+    host, port = address
+    allowed = host.lower() in ALLOWED_HOSTS
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for *_, sockaddr in infos:
+        ip = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        if not allowed and not is_public_address(ip):
+            raise CoverFetchError(f"Refusing to fetch a cover from non-public address {ip}")
+    error = None
+    for family, type_, proto, _, sockaddr in infos:
+        sock = socket.socket(family, type_, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f"Could not resolve {host}")
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+# no proxies (they would hide the real destination) and only http(s)
+_opener = urllib.request.OpenerDirector()
+for _handler in (
+    urllib.request.UnknownHandler(), urllib.request.HTTPDefaultErrorHandler(),
+    urllib.request.HTTPRedirectHandler(), urllib.request.HTTPErrorProcessor(),
+    _PublicHTTPHandler(), _PublicHTTPSHandler(),
+):
+    _opener.add_handler(_handler)
+
+def fetch_remote(url: str) -> bytes:
+    request = urllib.request.Request(url, headers={"User-Agent": "LibraryHub-CoverCache/1.0"})
+    try:
+        with _opener.open(request, timeout=FETCH_TIMEOUT) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith("image/"):
+                raise CoverFetchError(f"Cover URL did not return an image ({content_type})")
+            data = response.read(MAX_REMOTE_BYTES + 1)
+    except OSError as e:
+        raise CoverFetchError(f"Could not fetch cover: {e}")
+    if len(data) > MAX_REMOTE_BYTES:
+        raise CoverFetchError("Cover image too large")
+    if sniff_media_type(data) == "application/octet-stream":
+        raise CoverFetchError("Cover URL did not return a JPEG, PNG, WebP or GIF image")
+    return data
+
+class CoverCache:
+    def __init__(self, directory: str = COVER_CACHE_DIR, max_bytes: int = COVER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fetch = fetch_remote
+        self._lock = threading.Lock()
+        self._files: OrderedDict[str, int] = OrderedDict()  # name -> size, oldest first
+        self._size = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            st = os.stat(os.path.join(self.directory, name))
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._size += size
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _lookup(self, name: str) -> Optional[str]:
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        path = self._path(name)
+        try:
+            os.utime(path)  # keeps LRU order across restarts
+        except OSError:
+            with self._lock:
+                self._size -= self._files.pop(name, 0)
+            return None
+        return path
+
+    def _store(self, name: str, data: bytes) -> str:
+        path = self._path(name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            victims = []
+            while self._size > self.max_bytes and len(self._files) > 1:
+                # the file just stored is newest, so it is never picked here
+                victim, size = self._files.popitem(last=False)
+                self._size -= size
+                victims.append(victim)
+        for victim in victims:
+            try:
+                os.remove(self._path(victim))
+            except OSError:
+                pass
+        return path
+
+    def _original(self, url: str, key: str) -> bytes:
+        original = self._lookup(f"{key}.orig")
+        if original:
+            try:
+                with open(original, "rb") as f:
+                    return f.read()
+            except OSError:
+                pass
+        data = self.fetch(url)
+        self._store(f"{key}.orig", data)
+        return data
+
+    def _resize(self, data: bytes, name: str, width: int, fmt: str) -> str:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                if img.width * img.height > MAX_PIXELS:
+                    raise CoverFetchError("Cover image has too many pixels")
+                img = img.convert("RGB")
+                img.thumbnail((width, width * 2))
+                out = io.BytesIO()
+                if fmt == "webp":
+                    img.save(out, "WEBP", quality=80, method=4)
+                else:
+                    img.save(out, "JPEG", quality=82, optimize=True, progressive=True)
+        except (OSError, Image.DecompressionBombError) as e:
+            raise CoverFetchError(f"Unreadable cover image: {e}")
+        return self._store(name, out.getvalue())
+
+    async def _single_flight(self, name: str, fn, *args):
+        """Run `fn` in the threadpool once per `name`; concurrent callers share the result"""
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        return await asyncio.shield(task)
+
+    async def get(self, url: str, width: int, fmt: str) -> tuple[str, str]:
+        """Path and media type of the requested variant, fetching on a miss"""
+        key = cover_key(url)
+        if Image is None:
+            data = await self._single_flight(f"{key}.orig", self._original, url, key)
+            return self._path(f"{key}.orig"), sniff_media_type(data)
+
+        ext, media_type = ("webp", "image/webp") if fmt == "webp" else ("jpg", "image/jpeg")
+        name = f"{key}_{width}.{ext}"
+        path = self._lookup(name)
+        if path:
+            return path, media_type
+        data = await self._single_flight(f"{key}.orig", self._original, url, key)
+        return await self._single_flight(name, self._resize, data, name, width, fmt), media_type
+
+    async def read(self, url: str, width: int, fmt: str) -> tuple[bytes, str]:
+        """Contents and media type of the requested variant.
+
+        A file can be evicted between its lookup and the read; the second
+        attempt then fetches or resizes it again.
+        """
+        for attempt in range(2):
+            path, media_type = await self.get(url, width, fmt)
+            try:
+                return await run_in_threadpool(_read_file, path), media_type
+            except FileNotFoundError:
+                with self._lock:
+                    self._size -= self._files.pop(os.path.basename(path), 0)
+                if attempt:
+                    raise CoverFetchError("Cover was evicted while being served, try again")
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"files": len(self._files), "bytes": self._size, "max_bytes": self.max_bytes}
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+_cache: Optional[CoverCache] = None
+
+def get_cache() -> CoverCache:
+    global _cache
+    if _cache is None:
+        _cache = CoverCache()
+    return _cache
@@ -1,39 +1,220 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+"""Engines and sessions: one database per library branch, each with an
+optional pool of read replicas.
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./library.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Branches come from `LIBRARY_BRANCHES`, e.g. `main,north,south=/srv/south.db`;
+a value is a SQLite path or a full database URL (`postgresql://...`), and a
+branch without one lives in `library_<branch>.db`. The default branch uses
+`DATABASE_URL` (default `library.db`). Each branch has its own engine and
+database, so writes at one branch never wait on another branch's writer lock.
+
+Read replicas are listed per branch, comma separated, in
+`DATABASE_REPLICA_URLS` (default branch) or `DATABASE_REPLICA_URLS_<BRANCH>`.
+Read-only routes take `get_read_db`, which spreads them over the replicas;
+everything else takes `get_db` and runs on the primary. A client that has
+just written reads from the primary for `READ_YOUR_WRITES_SECONDS`. Replicas
+are only read from; keeping them in sync is left to the database (streaming
+replication, or a tool like Litestream for SQLite files).
+"""
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./library.db")
+DEFAULT_BRANCH = os.getenv("LIBRARY_DEFAULT_BRANCH", "main")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+def _database_url(value: str) -> str:
+    return value if "://" in value else f"sqlite:///{value}"
+
+def _branch_urls() -> dict[str, str]:
+    urls = {DEFAULT_BRANCH: SQLALCHEMY_DATABASE_URL}
+    for item in os.getenv("LIBRARY_BRANCHES", "").split(","):
+        name, _, value = item.strip().partition("=")
+        if not name:
+            continue
+        if value:
+            urls[name] = _database_url(value)
+        elif name not in urls:
+            urls[name] = f"sqlite:///./library_{name}.db"
+    return urls
+
+def _replica_urls(branch: str) -> list[str]:
+    key = "DATABASE_REPLICA_URLS" if branch == DEFAULT_BRANCH else f"DATABASE_REPLICA_URLS_{branch.upper()}"
+    return [_database_url(v.strip()) for v in os.getenv(key, "").split(",") if v.strip()]
+
+def _make_engine(url: str):
+    if make_url(url).get_backend_name() != "sqlite":
+        # server databases: pooled connections, checked before use since a
+        # replica may have restarted underneath the pool
+        return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # readers don't block the writer, and a busy writer is waited for
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    return engine
+
+def _sessionmaker(engine, branch: str, replica: bool = False):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"branch": branch, "replica": replica})
+
+BRANCH_URLS = _branch_urls()
+engines = {branch: _make_engine(url) for branch, url in BRANCH_URLS.items()}
+sessions = {branch: _sessionmaker(e, branch) for branch, e in engines.items()}
+replica_engines = {branch: [_make_engine(url) for url in _replica_urls(branch)] for branch in engines}
+_replica_sessions = {
+    branch: itertools.cycle([_sessionmaker(e, branch, replica=True) for e in pool])
+    for branch, pool in replica_engines.items() if pool
+}
+
+engine = engines[DEFAULT_BRANCH]
+SessionLocal = sessions[DEFAULT_BRANCH]
 
 class Base(DeclarativeBase):
     pass
 
-def get_db():
-    db = SessionLocal()
+class RecentWriters:
+    """Clients that wrote within the last `window` seconds, so their reads stay
+    on the primary until the replicas have caught up. Only the `max_keys` most
+    recent writers are kept."""
+
+    def __init__(self, window: float, max_keys: int = 100_000):
+        self.window = window
+        self.max_keys = max_keys
+        self._until: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, key: str):
+        with self._lock:
+            self._until[key] = time.monotonic() + self.window
+            self._until.move_to_end(key)
+            while len(self._until) > self.max_keys:
+                self._until.popitem(last=False)
+
+    def active(self, key: str) -> bool:
+        with self._lock:
+            until = self._until.get(key)
+            if until is None:
+                return False
+            if until > time.monotonic():
+                return True
+            del self._until[key]
+            return False
+
+recent_writers = RecentWriters(READ_YOUR_WRITES_SECONDS)
+
+def _client_key(request: Request, branch: str) -> str:
+    # the bearer token when there is one, otherwise the client address
+    ident = request.headers.get("authorization") or (request.client.host if request.client else "")
+    return f"{branch}:{ident}"
+
+def session_for(branch: str) -> Session:
+    factory = sessions.get(branch)
+    if factory is None:
+        raise HTTPException(status_code=404, detail=f"Unknown branch: {branch}")
+    return factory()
+
+def read_session_for(branch: str) -> Session:
+    """Session on the next replica of `branch`, or on its primary if it has none"""
+    replicas = _replica_sessions.get(branch)
+    if replicas is None:
+        return session_for(branch)
+    return next(replicas)()
+
+def request_branch(request: Request) -> str:
+    """Branch picked by BranchMiddleware from the URL or the bearer token"""
+    return getattr(request.state, "branch", None) or DEFAULT_BRANCH
+
+def branch_of(db: Session) -> str:
+    return db.info.get("branch", DEFAULT_BRANCH)
+
+def get_db(request: Request):
+    branch = request_branch(request)
+    db = session_for(branch)
     try:
         yield db
     finally:
         db.close()
+        if request.method not in SAFE_METHODS and branch in _replica_sessions:
+            recent_writers.mark(_client_key(request, branch))
 
-from . import models  # noqa: E402
+def get_read_db(request: Request):
+    """Session for read-only routes: a replica unless this client just wrote"""
+    branch = request_branch(request)
+    if branch in _replica_sessions and not recent_writers.active(_client_key(request, branch)):
+        db = read_session_for(branch)
+    else:
+        db = session_for(branch)
+    try:
+        yield db
+    finally:
+        db.close()
 
-def hash_password(password: str) -> str:
-    """Plain text password storage (no hashing)"""
-    return password
+from . import models  # noqa: E402
 
-def verify_password(password: str, stored: str) -> bool:
-    """Verify password against stored plain text"""
-    return password == stored
+from .security import hash_password, verify_password  # noqa: E402,F401
 
 def init_db():
-    # Drop all tables
-    Base.metadata.drop_all(bind=engine)
-    # Create all tables
-    Base.metadata.create_all(bind=engine)
-    
-    db = SessionLocal()
+    for branch in engines:
+        init_branch(branch)
+
+def _add_missing_columns(branch: str):
+    """Add model columns an existing table lacks, when that is safe (nullable, no default)"""
+    engine = engines[branch]
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+    unsafe = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            have = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in have:
+                    continue
+                if not column.nullable or column.server_default is not None or column.primary_key:
+                    unsafe.append(f"{table.name}.{column.name}")
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                    f"{column.type.compile(dialect=engine.dialect)}"
+                ))
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        index.create(bind=conn, checkfirst=True)
+                print(f"Added column {table.name}.{column.name} to branch {branch}")
+    if unsafe:
+        raise RuntimeError(
+            f"Database of branch {branch} has an older schema (missing {', '.join(unsafe)}); "
+            "migrate it, or move it aside to start with a fresh one"
+        )
+
+def init_branch(branch: str):
+    from .analytics import fill_monthly
+    from .isbn import try_normalize_isbn
+
+    # Only create what is missing, never drop: the database may be a moved
+    # branch, and it holds the event log and analytics rollups
+    Base.metadata.create_all(bind=engines[branch])
+    _add_missing_columns(branch)
+
+    db = sessions[branch]()
     try:
         # Add default admin user if no users exist
         if db.query(models.User).count() == 0:
@@ -46,7 +227,7 @@ def init_db():
                 email_verified=True
             )
             db.add(admin_user)
-            print("Default admin user created: admin/admin")
+            print(f"Default admin user created for branch {branch}: admin/admin")
         
         # Add seed books if no books exist
         if db.query(models.Book).count() == 0:
@@ -153,8 +334,15 @@ def init_db():
                 )
             ]
             for book in seed_books:
+                book.isbn13 = try_normalize_isbn(book.isbn)
                 db.add(book)
-            print("Seed books added to database")
+            print(f"Seed books added to branch {branch}")
+
+        # the monthly per-book rollup was added after the daily one
+        if db.query(models.MonthlyBookCirculation).first() is None and \
+                db.query(models.DailyBookCirculation).first() is not None:
+            fill_monthly(db)
+            print(f"Monthly book rollup filled for branch {branch}")
         
         db.commit()
     finally:
@@ -0,0 +1,280 @@
+"""Append-only event log with write-behind batching.
+
+Routes hand events to `emit()`, which only puts them on a bounded in-memory
+queue. One background writer drains whatever has queued up and inserts it
+with a single transaction per branch (group commit), so a burst of requests
+costs one commit instead of one per event.
+
+`EVENT_LOG_DURABILITY` picks the trade-off:
+- `buffered` (default): `emit()` returns once the events are queued.
+  Events still queued when the process dies are lost.
+- `commit`: `emit()` returns once the batch holding the event is committed,
+  or after `EVENT_LOG_COMMIT_TIMEOUT` seconds.
+
+In both modes a full queue blocks the caller until the writer makes room,
+so events are never dropped to shed load. The request's connection goes
+back to the pool before `emit()` can wait, since the writer needs one from
+the same pool.
+
+A batch that fails to insert is retried a few times, then counted as failed.
+The change it describes has already committed, so the request still
+succeeds.
+
+The log is the feed for rebuilding derived state:
+
+    python -m app.eventlog replay [--branch <branch>] [--after <id>]   # JSON lines
+    python -m app.eventlog rebuild [--branch <branch>]   # analytics rollups + availability
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+from . import analytics, models
+from .db import branch_of
+
+EVENT_LOG_QUEUE_SIZE = int(os.getenv("EVENT_LOG_QUEUE_SIZE", "10000"))
+EVENT_LOG_BATCH_SIZE = int(os.getenv("EVENT_LOG_BATCH_SIZE", "500"))
+EVENT_LOG_DURABILITY = os.getenv("EVENT_LOG_DURABILITY", "buffered")  # buffered/commit
+EVENT_LOG_COMMIT_TIMEOUT = float(os.getenv("EVENT_LOG_COMMIT_TIMEOUT", "10"))
+EVENT_LOG_RETRIES = 3
+
+LOAN_BORROWED = "loan.borrowed"
+LOAN_RETURNED = "loan.returned"
+
+_STOP = object()
+
+def event(kind: str, user_id: Optional[int] = None, book_id: Optional[int] = None,
+          ref_id: Optional[int] = None, ts: Optional[datetime] = None, **data) -> dict:
+    """One event_log row; extra keyword arguments go into its JSON `data`"""
+    return {
+        "ts": ts or datetime.utcnow(),
+        "type": kind,
+        "user_id": user_id,
+        "book_id": book_id,
+        "ref_id": ref_id,
+        "data": json.dumps(data, default=str) if data else None,
+    }
+
+class EventLog:
+    def __init__(self, max_queue: int = EVENT_LOG_QUEUE_SIZE, batch_size: int = EVENT_LOG_BATCH_SIZE,
+                 durability: str = EVENT_LOG_DURABILITY):
+        if durability not in ("buffered", "commit"):
+            raise ValueError(f"EVENT_LOG_DURABILITY must be buffered or commit, not {durability}")
+        self.durability = durability
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counts = {"written": 0, "batches": 0, "waited": 0, "failed": 0, "retried": 0, "unconfirmed": 0}
+        self._last_error: Optional[str] = None
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._counts[key] += n
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="eventlog-writer", daemon=True)
+                self._thread.start()
+
+    def close(self, timeout: float = 10):
+        """Flush everything queued so far and stop the writer"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def append(self, branch: str, rows: list[dict]) -> Optional[Future]:
+        """Queue rows for `branch`. In commit mode returns a future resolved on commit"""
+        if not rows:
+            return None
+        if self._thread is None:
+            self.start()
+        done = Future() if self.durability == "commit" else None
+        try:
+            self._queue.put_nowait((branch, rows, done))
+        except queue.Full:
+            # back-pressure instead of dropping, so the log stays complete
+            self._count("waited")
+            self._queue.put((branch, rows, done))
+        return done
+
+    def _run(self):
+        from .db import sessions
+
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, size = [item], len(item[1])
+            # group commit: take whatever else queued up while the last batch was written
+            while size < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[1])
+            self._flush(sessions, batch)
+
+    def _flush(self, sessions, batch: list[tuple[str, list[dict], Optional[Future]]]):
+        by_branch: dict[str, list] = defaultdict(list)
+        for item in batch:
+            by_branch[item[0]].append(item)
+        for branch, items in by_branch.items():
+            rows = [row for _, item_rows, _ in items for row in item_rows]
+            if self._insert(sessions[branch], rows):
+                self._count("written", len(rows))
+                self._count("batches")
+            else:
+                self._count("failed", len(rows))
+            # callers are released either way: the changes they logged have committed
+            for _, _, done in items:
+                if done is not None:
+                    done.set_result(None)
+
+    def _insert(self, session_factory, rows: list[dict]) -> bool:
+        for attempt in range(EVENT_LOG_RETRIES):
+            if attempt:
+                self._count("retried")
+                time.sleep(0.1 * 2 ** attempt)
+            db = session_factory()
+            try:
+                db.execute(insert(models.EventLogEntry), rows)
+                db.commit()
+                return True
+            except Exception as e:  # keep the writer alive
+                db.rollback()
+                with self._lock:
+                    self._last_error = repr(e)
+            finally:
+                db.close()
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counts, "queued": self._queue.qsize(), "durability": self.durability,
+                "last_error": self._last_error,
+            }
+
+log = EventLog()
+
+def _release_connection(db: Session):
+    # end the transaction refresh() opened without expiring the objects it
+    # loaded, so the response can still be built from them
+    expire, db.expire_on_commit = db.expire_on_commit, False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = expire
+
+def emit(db: Session, rows: Iterable[dict]):
+    """Log events on `db`'s branch after the change they describe has committed
+    (sync routes only)"""
+    rows = list(rows)
+    if not rows:
+        return
+    # before append(), which blocks while the queue is full
+    _release_connection(db)
+    done = log.append(branch_of(db), rows)
+    if done is None:
+        return
+    try:
+        done.result(timeout=EVENT_LOG_COMMIT_TIMEOUT)
+    except FutureTimeout:
+        log._count("unconfirmed")
+
+def replay(db: Session, after_id: int = 0, types: Optional[Iterable[str]] = None,
+           chunk: int = 1000) -> Iterator[models.EventLogEntry]:
+    """Events with id > after_id in log order, read in keyset-paginated chunks"""
+    types = list(types or ())
+    while True:
+        q = db.query(models.EventLogEntry).filter(models.EventLogEntry.id > after_id)
+        if types:
+            q = q.filter(models.EventLogEntry.type.in_(types))
+        rows = q.order_by(models.EventLogEntry.id).limit(chunk).all()
+        if not rows:
+            return
+        yield from rows
+        after_id = rows[-1].id
+
+def rebuild(db: Session):
+    """Recompute the analytics rollups and book availability from the log alone.
+
+    Only books that appear in loan events get their availability reset, so
+    this is exact as long as the log covers those books' whole history.
+    """
+    for model in analytics.ROLLUPS:
+        db.execute(delete(model))
+    open_loans: dict[int, int] = defaultdict(int)
+    borrows, returns = [], []
+
+    def fold():
+        analytics.record(db, borrows=borrows, returns=returns)
+        borrows.clear()
+        returns.clear()
+
+    for entry in replay(db, types=(LOAN_BORROWED, LOAN_RETURNED)):
+        data = json.loads(entry.data or "{}")
+        if entry.type == LOAN_BORROWED:
+            open_loans[entry.book_id] += 1
+            borrows.append((entry.book_id, data.get("category"), entry.ts))
+        else:
+            open_loans[entry.book_id] -= 1
+            borrowed_at = datetime.fromisoformat(data["borrowed_at"]) if data.get("borrowed_at") else entry.ts
+            returns.append((entry.book_id, data.get("category"), borrowed_at, entry.ts))
+        if len(borrows) + len(returns) >= 1000:
+            fold()
+    fold()
+
+    out = [book_id for book_id, n in open_loans.items() if n > 0]
+    back = [book_id for book_id, n in open_loans.items() if n <= 0]
+    for ids, available in ((out, False), (back, True)):
+        if ids:
+            db.execute(
+                update(models.Book).where(models.Book.id.in_(ids)).values(available=available),
+                execution_options={"synchronize_session": False},
+            )
+    db.commit()
+
+if __name__ == "__main__":
+    from .db import DEFAULT_BRANCH, sessions
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ("replay", "rebuild"):
+        sys.exit("usage: python -m app.eventlog replay|rebuild [--branch <branch>] [--after <id>]")
+    branch = args[args.index("--branch") + 1] if "--branch" in args[:-1] else DEFAULT_BRANCH
+    if branch not in sessions:
+        sys.exit(f"unknown branch: {branch}")
+    session = sessions[branch]()
+    try:
+        if args[0] == "replay":
+            after = int(args[args.index("--after") + 1]) if "--after" in args[:-1] else 0
+            for entry in replay(session, after_id=after):
+                print(json.dumps({
+                    "id": entry.id, "ts": entry.ts.isoformat(), "type": entry.type,
+                    "user_id": entry.user_id, "book_id": entry.book_id, "ref_id": entry.ref_id,
+                    "data": json.loads(entry.data) if entry.data else None,
+                }))
+        else:
+            rebuild(session)
+            print(f"rebuilt analytics rollups and availability for branch {branch} from the event log")
+    finally:
+        session.close()
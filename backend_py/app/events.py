@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import object_session
+
+from .db import DEFAULT_BRANCH, branch_of
+
+# Per-subscriber queue bound; a subscriber that falls this far behind is dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, branch: str, book_ids: set[int], categories: set[str]):
+        self.loop = loop
+        self.branch = branch
+        self.book_ids = book_ids
+        self.categories = categories
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+    def offer(self, event: dict):
+        """Runs on the event loop; drops the subscriber instead of blocking the publisher"""
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            # wake the reader so it can close the stream
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+class EventBus:
+    """In-process pub/sub for book changes.
+
+    Subscribers are indexed by branch plus book id or category so a publish
+    only touches the subscribers that asked for it; idle subscribers cost one
+    queue each.
+    Publishing is safe from the threadpool that runs the sync route handlers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_book: dict[tuple[str, int], set[Subscriber]] = {}
+        self._by_category: dict[tuple[str, str], set[Subscriber]] = {}
+        self._all: dict[str, set[Subscriber]] = {}
+
+    def subscribe(self, book_ids: Iterable[int] = (), categories: Iterable[str] = (),
+                  branch: str = DEFAULT_BRANCH) -> Subscriber:
+        sub = Subscriber(asyncio.get_running_loop(), branch, set(book_ids), set(categories))
+        with self._lock:
+            if not sub.book_ids and not sub.categories:
+                self._all.setdefault(branch, set()).add(sub)
+            for book_id in sub.book_ids:
+                self._by_book.setdefault((branch, book_id), set()).add(sub)
+            for category in sub.categories:
+                self._by_category.setdefault((branch, category), set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            keys = [(self._all, sub.branch)]
+            keys += [(self._by_book, (sub.branch, book_id)) for book_id in sub.book_ids]
+            keys += [(self._by_category, (sub.branch, category)) for category in sub.categories]
+            for index, key in keys:
+                subs = index.get(key)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del index[key]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            subs = set()
+            for s in self._all.values():
+                subs |= s
+            for s in self._by_book.values():
+                subs |= s
+            for s in self._by_category.values():
+                subs |= s
+            return len(subs)
+
+    def publish(self, event: dict):
+        with self._lock:
+            branch = event.get("branch", DEFAULT_BRANCH)
+            targets = set(self._all.get(branch, ()))
+            targets |= self._by_book.get((branch, event.get("book_id")), set())
+            targets |= self._by_category.get((branch, event.get("category")), set())
+        for sub in targets:
+            if sub.dropped:
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # loop already closed
+                pass
+
+bus = EventBus()
+
+def book_event(kind: str, book_id: int, category: Optional[str], available: Optional[bool],
+               branch: str = DEFAULT_BRANCH) -> dict:
+    return {"type": kind, "branch": branch, "book_id": book_id, "category": category, "available": available}
+
+def publish_book(kind: str, book) -> None:
+    """Publish a small delta for a Book row (call after commit)"""
+    db = object_session(book)
+    branch = branch_of(db) if db is not None else DEFAULT_BRANCH
+    bus.publish(book_event(kind, book.id, book.category, book.available, branch))
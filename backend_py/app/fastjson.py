@@ -0,0 +1,31 @@
+"""Fast serialization path for large list responses.
+
+Selects only the columns a response schema needs, as plain tuples, and
+encodes them with orjson. This skips ORM object hydration, per-row
+Pydantic validation and the default JSON encoder. Used by list endpoints
+when the client passes `?fast=true`.
+"""
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+def schema_columns(model, schema: type[BaseModel]) -> tuple[list[str], list]:
+    fields = list(schema.model_fields)
+    return fields, [getattr(model, f) for f in fields]
+
+def fast_rows(db: Session, model, schema: type[BaseModel], *criterion) -> list[dict]:
+    fields, columns = schema_columns(model, schema)
+    rows = db.query(*columns).filter(*criterion).all()
+    return [dict(zip(fields, row)) for row in rows]
+
+def fast_list(db: Session, model, schema: type[BaseModel], *criterion) -> FastJSONResponse:
+    return FastJSONResponse(fast_rows(db, model, schema, *criterion))
@@ -0,0 +1,66 @@
+"""FIFO hold queue handoff.
+
+A copy that comes back, or is marked available by hand, goes to the oldest
+waiting hold in the same transaction. It only becomes available when nobody
+is waiting, and while holds wait only the head of the queue may borrow it.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import eventlog, models
+
+LOAN_DAYS = 14
+
+def new_loan(user_id: int, book: models.Book, now: Optional[datetime] = None) -> models.Borrowing:
+    now = now or datetime.utcnow()
+    return models.Borrowing(
+        user_id=user_id,
+        book_id=book.id,
+        book_title=book.title,
+        book_author=book.author,
+        borrow_date=now,
+        return_date=now + timedelta(days=LOAN_DAYS),
+        status="borrowed",
+    )
+
+def queue_heads(db: Session, book_ids) -> dict[int, models.Hold]:
+    """Oldest waiting hold of each book that has one"""
+    heads: dict[int, models.Hold] = {}
+    for hold in db.query(models.Hold).filter(
+        models.Hold.book_id.in_(list(book_ids)),
+        models.Hold.status == "waiting",
+    ).order_by(models.Hold.id):
+        heads.setdefault(hold.book_id, hold)
+    return heads
+
+def queue_head(db: Session, book_id: int) -> Optional[models.Hold]:
+    return db.query(models.Hold).filter(
+        models.Hold.book_id == book_id,
+        models.Hold.status == "waiting",
+    ).order_by(models.Hold.id).first()
+
+def hand_off(db: Session, book: models.Book) -> Optional[tuple[models.Hold, models.Borrowing]]:
+    """Lend `book` to the head of its queue, or mark it available if nobody waits.
+
+    Call inside the transaction that freed the copy; returns the fulfilled
+    hold and its new loan, if any.
+    """
+    head = queue_head(db, book.id)
+    if head is None:
+        book.available = True
+        return None
+    loan = new_loan(head.user_id, book)
+    db.add(loan)
+    db.flush()
+    head.status = "fulfilled"
+    head.borrow_id = loan.id
+    book.available = False
+    return head, loan
+
+def fulfilled_events(hold: models.Hold, loan_id: int, category: Optional[str], at: datetime) -> list[dict]:
+    return [
+        eventlog.event("hold.fulfilled", hold.user_id, hold.book_id, hold.id, borrow_id=loan_id),
+        eventlog.event(eventlog.LOAN_BORROWED, hold.user_id, hold.book_id, loan_id, ts=at, category=category),
+    ]
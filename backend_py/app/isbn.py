@@ -0,0 +1,160 @@
+"""ISBN normalization and duplicate-book merging.
+
+`Book.isbn` keeps whatever was entered; `Book.isbn13` holds the canonical
+ISBN-13 (digits only, checksum verified) and carries the unique index used
+for lookups.
+
+Merge rows that already share an ISBN with:
+
+    python -m app.isbn [--dry-run] [--branch <branch>]
+"""
+import sys
+from typing import Optional
+
+from sqlalchemy import case, delete, func, insert, update
+from sqlalchemy.orm import Session
+
+from . import analytics, models
+from .eventlog import event
+
+DIGITS = frozenset("0123456789")
+
+class InvalidISBN(ValueError):
+    pass
+
+def _is_digits(value: str) -> bool:
+    # str.isdigit() also accepts digits like "²" that int() cannot parse
+    return bool(value) and all(c in DIGITS for c in value)
+
+def _isbn10_valid(digits: str) -> bool:
+    total = sum((10 - i) * (10 if c == "X" else int(c)) for i, c in enumerate(digits))
+    return total % 11 == 0
+
+def _isbn13_check(first12: str) -> str:
+    total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+def normalize_isbn(raw: str) -> str:
+    """Canonical ISBN-13 for an ISBN-10 or ISBN-13 in any common formatting"""
+    value = "".join(c for c in (raw or "").upper() if c.isascii() and c.isalnum())
+    if value.startswith("ISBN"):
+        value = value[4:]
+    if len(value) == 10 and _is_digits(value[:9]) and (value[9] in DIGITS or value[9] == "X"):
+        if not _isbn10_valid(value):
+            raise InvalidISBN(f"Invalid ISBN-10 checksum: {raw}")
+        body = "978" + value[:9]
+        return body + _isbn13_check(body)
+    if len(value) == 13 and _is_digits(value):
+        if value[:3] not in ("978", "979") or _isbn13_check(value[:12]) != value[12]:
+            raise InvalidISBN(f"Invalid ISBN-13: {raw}")
+        return value
+    raise InvalidISBN(f"Not an ISBN: {raw}")
+
+def try_normalize_isbn(raw: Optional[str]) -> Optional[str]:
+    try:
+        return normalize_isbn(raw) if raw else None
+    except InvalidISBN:
+        return None
+
+def merge_duplicates(db: Session, dry_run: bool = False) -> dict:
+    """Backfill `isbn13` and merge books sharing one, in a single transaction.
+
+    The lowest book id in each group survives. Borrowing, wishlist, hold and
+    event log rows of the others are re-pointed to it with one UPDATE per
+    table, their per-book analytics rollups are added onto its own, and the
+    duplicates are deleted. Each merge is recorded as a `book.merged` event.
+    """
+    groups: dict[str, list[int]] = {}
+    invalid = []
+    for book_id, isbn in db.query(models.Book.id, models.Book.isbn).filter(
+        models.Book.isbn.isnot(None)
+    ).order_by(models.Book.id):
+        key = try_normalize_isbn(isbn)
+        if key is None:
+            invalid.append(book_id)
+        else:
+            groups.setdefault(key, []).append(book_id)
+
+    survivors = {ids[0]: key for key, ids in groups.items()}
+    moved = {loser: ids[0] for ids in groups.values() for loser in ids[1:]}
+    report = {
+        "books_with_isbn": sum(len(ids) for ids in groups.values()),
+        "invalid_isbn_ids": invalid,
+        "duplicate_groups": sum(1 for ids in groups.values() if len(ids) > 1),
+        "merged": moved,
+    }
+    if dry_run:
+        return report
+
+    if moved:
+        losers = list(moved)
+        for model in (models.Borrowing, models.Wishlist, models.Hold, models.EventLogEntry):
+            db.execute(
+                update(model)
+                .where(model.book_id.in_(losers))
+                .values(book_id=case(moved, value=model.book_id)),
+                execution_options={"synchronize_session": False},
+            )
+        analytics.merge_books(db, moved)
+        db.execute(insert(models.EventLogEntry), [
+            event("book.merged", book_id=survivor, ref_id=loser) for loser, survivor in moved.items()
+        ])
+
+        # a user may now have the same book twice in their wishlist or hold queue
+        keep = db.query(func.min(models.Wishlist.id)).group_by(
+            models.Wishlist.user_id, models.Wishlist.book_id
+        )
+        db.execute(
+            delete(models.Wishlist).where(models.Wishlist.id.not_in(keep.scalar_subquery())),
+            execution_options={"synchronize_session": False},
+        )
+        keep = db.query(func.min(models.Hold.id)).filter(models.Hold.status == "waiting").group_by(
+            models.Hold.user_id, models.Hold.book_id
+        )
+        db.execute(
+            update(models.Hold)
+            .where(models.Hold.status == "waiting", models.Hold.id.not_in(keep.scalar_subquery()))
+            .values(status="cancelled"),
+            execution_options={"synchronize_session": False},
+        )
+
+        db.execute(
+            delete(models.Book).where(models.Book.id.in_(losers)),
+            execution_options={"synchronize_session": False},
+        )
+        # survivors are out if any merged copy is on loan
+        on_loan = db.query(models.Borrowing.book_id).filter(
+            models.Borrowing.book_id.in_(set(moved.values())),
+            models.Borrowing.status == "borrowed",
+        )
+        db.execute(
+            update(models.Book)
+            .where(models.Book.id.in_(on_loan.scalar_subquery()))
+            .values(available=False),
+            execution_options={"synchronize_session": False},
+        )
+
+    if survivors:
+        db.execute(update(models.Book), [{"id": i, "isbn13": key} for i, key in survivors.items()])
+    db.commit()
+    return report
+
+if __name__ == "__main__":
+    from .db import DEFAULT_BRANCH, sessions
+
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    branch = args[args.index("--branch") + 1] if "--branch" in args[:-1] else DEFAULT_BRANCH
+    if branch not in sessions:
+        sys.exit(f"unknown branch: {branch}")
+    session = sessions[branch]()
+    try:
+        result = merge_duplicates(session, dry_run=dry_run)
+    finally:
+        session.close()
+    print(f"books with a valid ISBN: {result['books_with_isbn']}")
+    print(f"invalid ISBNs (left unindexed): {len(result['invalid_isbn_ids'])}")
+    print(f"duplicate groups: {result['duplicate_groups']}")
+    print(f"{'would merge' if dry_run else 'merged'} {len(result['merged'])} books")
+    for loser, survivor in sorted(result["merged"].items()):
+        print(f"  {loser} -> {survivor}")
@@ -1,16 +1,27 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
 
-from .routers import users, books, borrowing
-from .db import init_db
+from .routers import users, books, borrowing, events, covers, analytics, profiles
+from .db import init_db, sessions
+from .recommendations import recommender_for
+from . import autocomplete, eventlog
+from .branches import BranchMiddleware
+from .admission import AdmissionMiddleware, controller as admission
+from .profiling import ProfilingMiddleware
+from .routers.users import get_current_admin
 
 # Create uploads directory before app initialization
 os.makedirs("uploads/avatars", exist_ok=True)
 
 app = FastAPI(title="Pustakalayah LibraryHub API", version="1.0.0")
 
+# profiling is innermost so it times the handler, not the admission queue
+app.add_middleware(ProfilingMiddleware)
+# sees paths after the branch prefix is stripped, and its 503s still pass
+# through CORS
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,20 +29,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(BranchMiddleware)
 
 @app.on_event("startup")
 async def on_startup():
     init_db()
+    for branch, session_factory in sessions.items():
+        db = session_factory()
+        try:
+            recommender_for(branch).rebuild(db)
+            autocomplete.index_for(branch).rebuild(db)
+        finally:
+            db.close()
     # Create uploads directory if it doesn't exist
     os.makedirs("uploads/avatars", exist_ok=True)
 
+@app.on_event("shutdown")
+def on_shutdown():
+    # flush events still waiting in the write-behind queue
+    eventlog.log.close()
+
 @app.get("/api/health")
 def health():
     return {"status": "OK"}
 
+@app.get("/api/health/admission", dependencies=[Depends(get_current_admin)])
+def admission_stats():
+    return admission.stats()
+
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(books.router, prefix="/api/books", tags=["books"])
 app.include_router(borrowing.router, prefix="/api/borrowing", tags=["borrowing"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
+app.include_router(covers.router, prefix="/api/covers", tags=["covers"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
+app.include_router(profiles.router, prefix="/api/profiles", tags=["profiles"])
 
 # Mount static files for uploads
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
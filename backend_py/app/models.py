@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, Date, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -20,6 +20,7 @@ class User(Base):
 
     borrowings = relationship("Borrowing", back_populates="user")
     wishlists = relationship("Wishlist", back_populates="user")
+    holds = relationship("Hold", back_populates="user")
 
 class Book(Base):
     __tablename__ = "books"
@@ -31,11 +32,13 @@ class Book(Base):
     image = Column(String, nullable=True)
     description = Column(String, nullable=True)
     isbn = Column(String, nullable=True)
+    isbn13 = Column(String, unique=True, index=True, nullable=True)  # canonical, see isbn.py
     published_year = Column(Integer, nullable=True)
     available = Column(Boolean, default=True)
 
     borrowings = relationship("Borrowing", back_populates="book")
     wishlists = relationship("Wishlist", back_populates="book")
+    holds = relationship("Hold", back_populates="book")
 
 class Borrowing(Base):
     __tablename__ = "borrowing"
@@ -64,3 +67,73 @@ class Wishlist(Base):
 
     user = relationship("User", back_populates="wishlists")
     book = relationship("Book", back_populates="wishlists")
+
+class Hold(Base):
+    __tablename__ = "holds"
+    # FIFO queue per book: waiting holds are scanned by (book_id, status, id)
+    __table_args__ = (
+        Index("ix_holds_book_status_id", "book_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    status = Column(String, default="waiting")  # waiting/fulfilled/cancelled
+    borrow_id = Column(Integer, ForeignKey("borrowing.id"), nullable=True)  # set when fulfilled
+
+    user = relationship("User", back_populates="holds")
+    book = relationship("Book", back_populates="holds")
+
+# Circulation rollups, kept current by app.analytics inside the borrow/return
+# transactions. Loan durations are summed on the day the book comes back.
+class DailyCirculation(Base):
+    __tablename__ = "stats_daily"
+
+    day = Column(Date, primary_key=True)
+    borrows = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
+    loan_seconds = Column(BigInteger, nullable=False, default=0)
+
+class DailyCategoryCirculation(Base):
+    __tablename__ = "stats_daily_category"
+
+    day = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    borrows = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
+    loan_seconds = Column(BigInteger, nullable=False, default=0)
+
+class DailyBookCirculation(Base):
+    __tablename__ = "stats_daily_book"
+
+    day = Column(Date, primary_key=True)
+    book_id = Column(Integer, primary_key=True)  # no FK: stats outlive deleted books
+    borrows = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
+    loan_seconds = Column(BigInteger, nullable=False, default=0)
+
+# Per-book totals by calendar month, so top-book reports over long ranges
+# read one row per book and month instead of one per book and day
+class MonthlyBookCirculation(Base):
+    __tablename__ = "stats_monthly_book"
+
+    month = Column(Date, primary_key=True)  # first day of the month
+    book_id = Column(Integer, primary_key=True)  # no FK: stats outlive deleted books
+    borrows = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
+    loan_seconds = Column(BigInteger, nullable=False, default=0)
+
+# Append-only log of circulation, wishlist and auth events, written in
+# batches by app.eventlog. Ids give the replay order. Rows are never updated,
+# except that app.isbn re-points book_id when it merges duplicate books.
+class EventLogEntry(Base):
+    __tablename__ = "event_log"
+
+    id = Column(Integer, primary_key=True)
+    ts = Column(DateTime, nullable=False, index=True)
+    type = Column(String, nullable=False, index=True)
+    user_id = Column(Integer, nullable=True, index=True)  # no FKs: the log outlives rows
+    book_id = Column(Integer, nullable=True)
+    ref_id = Column(Integer, nullable=True)  # borrowing/hold/wishlist id, by type
+    data = Column(Text, nullable=True)  # JSON
@@ -0,0 +1,357 @@
+"""On-demand request profiling.
+
+An admin request carrying `X-Profile: 1` (or `?profile=1`) runs under a
+sampling profiler. Its profile is stored and the response gets an
+`X-Profile-Id` header. With `X-Profile: inline` (or `?profile=inline`) the
+response body is replaced by the profile itself. With
+`PROFILE_SAMPLE_RATE=N`, one request in N is profiled and stored as well,
+without any flag.
+
+A profile holds wall-clock stack samples in collapsed ("folded") form,
+which flamegraph.pl and speedscope read directly, plus every SQL statement
+the request issued and its duration. One background thread samples the
+threads working on profiled requests every `PROFILE_INTERVAL_MS`:
+- the event loop thread
+- the worker thread running a sync endpoint, for routers that use
+  `ProfiledRoute`
+
+Loop samples can include other requests' coroutines. Stored profiles rotate
+in `PROFILE_DIR`, oldest first, so they stay under `PROFILE_MAX_BYTES`.
+
+The flag is honoured only for tokens whose `role` claim is admin, checked
+without touching the database. The role is then confirmed against the user
+row, and that answer is cached for `ADMIN_CACHE_SECONDS`. Streaming routes
+are never profiled, since their response never completes.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+from .security import bearer_claims
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("cache", "profiles"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(64 * 2**20)))
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # 1-in-N, 0 = off
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "2")) / 1000
+MAX_STACK_DEPTH = 128
+MAX_SQL = 1000
+MAX_SQL_CHARS = 2000
+ADMIN_CACHE_SECONDS = 30
+STREAMING_PREFIXES = ("/api/events/books",)
+
+class Profile:
+    def __init__(self, method: str, path: str, loop_thread: int):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.loop_thread = loop_thread
+        self.threads: set[int] = {loop_thread}
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.sql: list[dict] = []
+        self.sql_total = 0
+        self.status: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started": self.started,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "interval_ms": PROFILE_INTERVAL * 1000,
+            "samples": self.samples,
+            "folded": self.folded(),
+            "sql_count": self.sql_total,
+            "sql_ms": round(sum(q["ms"] for q in self.sql), 3),
+            "sql": self.sql,
+        }
+
+current_profile: ContextVar[Optional[Profile]] = ContextVar("current_profile", default=None)
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Sampler:
+    """One thread sampling the stacks of every active profile"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._active: set[Profile] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, profile: Profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile: Profile):
+        # taking the lock also waits out a tick in progress, so the profile is final
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for profile in self._active:
+                    self._sample(profile, frames)
+                del frames
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _sample(profile: Profile, frames: dict):
+        for ident in tuple(profile.threads):
+            frame = frames.get(ident)
+            if frame is None or frame.f_code.co_filename.endswith("selectors.py"):
+                continue  # gone, or the loop idling in select()
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append("event-loop" if ident == profile.loop_thread else "worker")
+            profile.stacks[";".join(reversed(stack))] += 1
+        profile.samples += 1
+
+sampler = Sampler()
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        context._profile_started = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is None or started is None:
+        return
+    profile.sql_total += 1
+    if len(profile.sql) < MAX_SQL:
+        profile.sql.append({
+            "sql": statement[:MAX_SQL_CHARS],
+            "ms": round((time.perf_counter() - started) * 1000, 3),
+            "executemany": executemany,
+            "rows": cursor.rowcount,
+        })
+
+def _track_thread(fn):
+    """Let the sampler see the worker thread while a sync endpoint runs"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        ident = threading.get_ident()
+        profile.threads.add(ident)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.threads.discard(ident)
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _track_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+class ProfileStore:
+    """Profiles as `<time>-<id>.json` files, oldest removed past `max_bytes`"""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_bytes: int = PROFILE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _files(self) -> list[str]:
+        try:
+            return sorted(n for n in os.listdir(self.directory) if n.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def save(self, profile: Profile):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{int(profile.started * 1000):013d}-{profile.id}.json"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(profile.to_dict(), f)
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            files = [(n, os.path.getsize(os.path.join(self.directory, n))) for n in self._files()]
+            total = sum(size for _, size in files)
+            for n, size in files[:-1]:
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.directory, n))
+                total -= size
+
+    def list(self) -> list[dict]:
+        out = []
+        for n in reversed(self._files()):
+            started, _, rest = n.partition("-")
+            out.append({"id": rest[:-len(".json")], "started": int(started) / 1000})
+        return out
+
+    def load(self, profile_id: str) -> Optional[dict]:
+        if not profile_id.isalnum():
+            return None
+        for n in self._files():
+            if n.endswith(f"-{profile_id}.json"):
+                with open(os.path.join(self.directory, n)) as f:
+                    return json.load(f)
+        return None
+
+store = ProfileStore()
+
+def _requested_mode(scope) -> Optional[str]:
+    """'store' or 'inline' if the request asks to be profiled"""
+    value = None
+    for name, v in scope.get("headers", []):
+        if name == b"x-profile":
+            value = v.decode("latin-1")
+            break
+    if value is None:
+        for part in scope.get("query_string", b"").decode("latin-1").split("&"):
+            key, _, v = part.partition("=")
+            if key == "profile":
+                value = v
+                break
+    if value is None or value.lower() in ("", "0", "false"):
+        return None
+    return "inline" if value.lower() == "inline" else "store"
+
+def _admin_claim(scope) -> Optional[tuple[str, str]]:
+    """(branch, username) if the bearer token claims an admin on this branch; no DB access"""
+    from .db import DEFAULT_BRANCH, sessions
+
+    payload = bearer_claims(scope.get("headers", []))
+    if payload is None:
+        return None
+    branch = scope.get("state", {}).get("branch") or DEFAULT_BRANCH
+    if payload.get("role") != "admin" or payload.get("branch", DEFAULT_BRANCH) != branch or branch not in sessions:
+        return None
+    return branch, payload.get("sub")
+
+def _is_admin(branch: str, username: str) -> bool:
+    from . import models
+    from .db import sessions
+
+    db = sessions[branch]()
+    try:
+        return db.query(models.User.id).filter(
+            models.User.username == username, models.User.role == "admin"
+        ).first() is not None
+    finally:
+        db.close()
+
+class AdminCache:
+    """Role checks of admin-claiming tokens, so repeated flags cost one query per window"""
+
+    def __init__(self, ttl: float = ADMIN_CACHE_SECONDS):
+        self.ttl = ttl
+        self._until: dict[tuple[str, str], tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+
+    async def is_admin(self, branch: str, username: str) -> bool:
+        key = (branch, username)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._until.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        ok = await run_in_threadpool(_is_admin, branch, username)
+        with self._lock:
+            self._until[key] = (ok, now + self.ttl)
+        return ok
+
+admins = AdminCache()
+
+class ProfilingMiddleware:
+    def __init__(self, app, sample_rate: int = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+        self._counter = itertools.count(1)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"].startswith(STREAMING_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        mode = _requested_mode(scope)
+        if mode:
+            claim = _admin_claim(scope)
+            if claim is None or not await admins.is_admin(*claim):
+                mode = None
+        if mode is None and self.sample_rate and next(self._counter) % self.sample_rate == 0:
+            mode = "store"
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], threading.get_ident())
+        inline = mode == "inline"
+
+        async def send_profiled(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if inline:
+                    return
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            elif message["type"] == "http.response.body" and inline:
+                return
+            await send(message)
+
+        token = current_profile.set(profile)
+        sampler.start(profile)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            sampler.stop(profile)
+            current_profile.reset(token)
+            profile.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        if inline:
+            body = json.dumps(profile.to_dict()).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-profile-id", profile.id.encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+        else:
+            await run_in_threadpool(store.save, profile)
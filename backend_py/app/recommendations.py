@@ -0,0 +1,230 @@
+"""Readers-also-borrowed recommendations from borrowing history.
+
+A sparse user x book matrix built from `models.Borrowing` gives the
+book x book co-borrow counts as `U.T @ U`. The top-k neighbours of every
+book are precomputed, so reads are a dict lookup. New borrows are folded in
+incrementally: the borrowed book's top-k is recomputed and the one changed
+count is merged into the top-k of the user's other books. Accumulated
+deltas are compacted into a fresh matrix once they grow past
+`compact_threshold` entries. The matrix is built on a background thread
+without the index lock, and borrows made meanwhile are replayed onto it.
+Ties are broken by lower book id.
+"""
+import heapq
+import threading
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional dependency
+    np = None
+    sparse = None
+
+TOP_K = 20
+
+class CoBorrowIndex:
+    def __init__(self, k: int = TOP_K, compact_threshold: int = 200_000):
+        self.k = k
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._book_ids = None  # compact index -> book id
+        self._book_index: dict[int, int] = {}
+        self._co = None  # csr book x book co-borrow counts
+        self._delta: dict[int, dict[int, int]] = {}
+        self._delta_size = 0
+        self._baskets: dict[int, set[int]] = {}
+        self._topk: dict[int, tuple[tuple[int, int], ...]] = {}
+        self._generation = 0  # bumped by every build, so a stale compaction is dropped
+        self._pending: Optional[list[tuple[int, int]]] = None  # borrows made while compacting
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def rebuild(self, db: Session):
+        """Full rebuild from the borrowing table"""
+        if not self.available:
+            return
+        rows = db.query(models.Borrowing.user_id, models.Borrowing.book_id).distinct().all()
+        if rows:
+            user_ids, book_ids = (np.fromiter(col, dtype=np.int64, count=len(rows)) for col in zip(*rows))
+        else:
+            user_ids = book_ids = np.empty(0, dtype=np.int64)
+        self.build(user_ids, book_ids)
+
+    def build(self, user_ids, book_ids):
+        """Build from parallel arrays of (user id, book id) borrow pairs"""
+        state = self._compute(user_ids, book_ids)
+        with self._lock:
+            self._install(*state)
+
+    def _compute(self, user_ids, book_ids) -> tuple:
+        """The matrix, baskets and top-k lists; runs without the lock"""
+        users, user_idx = np.unique(user_ids, return_inverse=True)
+        books, book_idx = np.unique(book_ids, return_inverse=True)
+        borrowed = sparse.csr_matrix(
+            (np.ones(len(user_idx), dtype=np.int32), (user_idx, book_idx)),
+            shape=(len(users), len(books)),
+        )
+        borrowed.data[:] = 1  # repeat borrows of the same book count once
+        co = (borrowed.T @ borrowed).tocsr()
+        co.setdiag(0)
+        co.eliminate_zeros()
+        co.sort_indices()
+
+        baskets = {
+            int(users[u]): set(books[borrowed.indices[borrowed.indptr[u]:borrowed.indptr[u + 1]]].tolist())
+            for u in range(len(users))
+        }
+        topk = {}
+        indptr, indices, data = co.indptr, co.indices, co.data
+        for i in range(len(books)):
+            start, end = indptr[i], indptr[i + 1]
+            if start == end:
+                continue
+            counts = data[start:end]
+            if end - start > self.k:
+                # everything tied with the k-th count is kept so ties break by id
+                top = np.nonzero(counts >= np.partition(counts, -self.k)[-self.k])[0]
+            else:
+                top = np.arange(end - start)
+            top = top[np.lexsort((books[indices[start:end][top]], -counts[top]))][:self.k]
+            topk[int(books[i])] = tuple(zip(books[indices[start:end][top]].tolist(), counts[top].tolist()))
+
+        return books, co, baskets, topk
+
+    def _install(self, books, co, baskets, topk):
+        self._book_ids = books
+        self._book_index = {int(b): i for i, b in enumerate(books.tolist())}
+        self._co = co
+        self._delta = {}
+        self._delta_size = 0
+        self._baskets = baskets
+        self._topk = topk
+        self._generation += 1
+
+    def _row(self, book_id: int) -> dict[int, int]:
+        counts = {}
+        i = self._book_index.get(book_id)
+        if i is not None:
+            start, end = self._co.indptr[i], self._co.indptr[i + 1]
+            counts = dict(zip(
+                self._book_ids[self._co.indices[start:end]].tolist(),
+                self._co.data[start:end].tolist(),
+            ))
+        for other, n in self._delta.get(book_id, {}).items():
+            counts[other] = counts.get(other, 0) + n
+        return counts
+
+    def _count(self, book_id: int, other: int) -> int:
+        n = self._delta.get(book_id, {}).get(other, 0)
+        i, j = self._book_index.get(book_id), self._book_index.get(other)
+        if i is not None and j is not None:
+            start, end = self._co.indptr[i], self._co.indptr[i + 1]
+            pos = start + np.searchsorted(self._co.indices[start:end], j)
+            if pos < end and self._co.indices[pos] == j:
+                n += int(self._co.data[pos])
+        return n
+
+    def _bump_topk(self, book_id: int, other: int):
+        """Only `other`'s count in this row went up, so merge it into the current top-k"""
+        current = [kv for kv in self._topk.get(book_id, ()) if kv[0] != other]
+        current.append((other, self._count(book_id, other)))
+        self._topk[book_id] = tuple(heapq.nlargest(self.k, current, key=lambda kv: (kv[1], -kv[0])))
+
+    def _refresh_topk(self, book_id: int):
+        best = heapq.nlargest(self.k, self._row(book_id).items(), key=lambda kv: (kv[1], -kv[0]))
+        self._topk[book_id] = tuple(best)
+
+    def record_borrow(self, user_id: int, book_id: int):
+        """Fold a single new borrow into the index"""
+        if not self.available:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((user_id, book_id))
+            self._fold(user_id, book_id)
+            if self._pending is not None or self._delta_size < self.compact_threshold:
+                return
+            self._pending = []
+            generation = self._generation
+            pairs = [(u, b) for u, bs in self._baskets.items() for b in bs]
+        threading.Thread(target=self._compact, args=(pairs, generation), daemon=True).start()
+
+    def _fold(self, user_id: int, book_id: int):
+        basket = self._baskets.setdefault(user_id, set())
+        if book_id in basket:
+            return
+        for other in basket:
+            self._delta.setdefault(book_id, {})
+            self._delta[book_id][other] = self._delta[book_id].get(other, 0) + 1
+            self._delta.setdefault(other, {})
+            self._delta[other][book_id] = self._delta[other].get(book_id, 0) + 1
+        self._delta_size += 2 * len(basket)
+        basket.add(book_id)
+        self._refresh_topk(book_id)
+        for other in basket:
+            if other != book_id:
+                self._bump_topk(other, book_id)
+
+    def _compact(self, pairs: list[tuple[int, int]], generation: int):
+        """Fold the deltas into a fresh matrix, then replay borrows made meanwhile"""
+        try:
+            state = self._compute(
+                np.fromiter((u for u, _ in pairs), dtype=np.int64, count=len(pairs)),
+                np.fromiter((b for _, b in pairs), dtype=np.int64, count=len(pairs)),
+            )
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if self._generation != generation:
+                return  # rebuilt from the database meanwhile, which already has them
+            self._install(*state)
+            for user_id, book_id in pending:
+                self._fold(user_id, book_id)
+
+    def similar(self, book_id: int, limit: int = 10) -> list[tuple[int, int]]:
+        """(book id, co-borrow count) pairs, most co-borrowed first"""
+        return list(self._topk.get(book_id, ())[:limit])
+
+    def recommend_for_user(self, user_id: int, limit: int = 10,
+                           exclude: Optional[Iterable[int]] = None) -> list[tuple[int, int]]:
+        """Sum the precomputed neighbour lists of everything the user has borrowed"""
+        with self._lock:
+            basket = set(self._baskets.get(user_id, ()))
+        skip = basket | set(exclude or ())
+        scores: dict[int, int] = {}
+        for book_id in basket:
+            for other, n in self._topk.get(book_id, ()):
+                if other not in skip:
+                    scores[other] = scores.get(other, 0) + n
+        return heapq.nlargest(limit, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+
+def similar_books(db: Session, ranked: list[tuple[int, int]]) -> list[schemas.SimilarBookOut]:
+    """Load ranked (book id, score) pairs, keeping rank order and skipping deleted books"""
+    if not ranked:
+        return []
+    books = {b.id: b for b in db.query(models.Book).filter(models.Book.id.in_([i for i, _ in ranked]))}
+    return [
+        schemas.SimilarBookOut(**schemas.BookOut.model_validate(books[book_id]).model_dump(), score=score)
+        for book_id, score in ranked if book_id in books
+    ]
+
+# book and user ids are per branch database, so each branch gets its own index
+_indexes: dict[str, CoBorrowIndex] = {}
+_indexes_lock = threading.Lock()
+
+def recommender_for(branch: str) -> CoBorrowIndex:
+    with _indexes_lock:
+        index = _indexes.get(branch)
+        if index is None:
+            index = _indexes[branch] = CoBorrowIndex()
+        return index
@@ -0,0 +1,53 @@
+from datetime import date, datetime
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from ..db import get_read_db
+from .. import analytics, schemas
+from ..profiling import ProfiledRoute
+from .users import get_current_admin
+
+router = APIRouter(route_class=ProfiledRoute, dependencies=[Depends(get_current_admin)])
+
+MAX_RANGE_DAYS = 3660
+
+def _range(start: date | None, end: date | None) -> tuple[date, date]:
+    """Defaults to the current month so far, in UTC like the rollup days"""
+    end = end or datetime.utcnow().date()
+    start = start or end.replace(day=1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days > MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail="Range too large")
+    return start, end
+
+@router.get("/summary", response_model=schemas.CirculationSummaryOut)
+def circulation_summary(start: date | None = None, end: date | None = None, db: Session = Depends(get_read_db)):
+    return analytics.summary(db, *_range(start, end))
+
+@router.get("/daily", response_model=list[schemas.DailyCirculationOut])
+def daily_circulation(start: date | None = None, end: date | None = None, db: Session = Depends(get_read_db)):
+    return analytics.daily(db, *_range(start, end))
+
+@router.get("/categories", response_model=list[schemas.CategoryPeriodOut])
+def circulation_by_category(
+    start: date | None = None,
+    end: date | None = None,
+    interval: Literal["day", "week", "month"] = "week",
+    db: Session = Depends(get_read_db),
+):
+    """Loans per category per day, week (starting Monday) or month"""
+    return analytics.by_category(db, *_range(start, end), interval)
+
+@router.get("/books/top", response_model=list[schemas.TopBookOut])
+def top_books(
+    start: date | None = None,
+    end: date | None = None,
+    limit: int = 20,
+    by: Literal["borrows", "returns"] = "borrows",
+    db: Session = Depends(get_read_db),
+):
+    """Most borrowed (or returned) books in the range, this month by default"""
+    return analytics.top_books(db, *_range(start, end), max(1, min(limit, 100)), by)
@@ -1,31 +1,152 @@
-from fastapi import APIRouter, Depends, HTTPException
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from ..db import get_db
-from .. import models, schemas
+from ..db import branch_of, engines, get_db, get_read_db, read_session_for
+from .. import analytics, eventlog, holds, models, schemas
+from ..events import bus, book_event, publish_book
+from ..fastjson import fast_list
+from ..profiling import ProfiledRoute
+from ..recommendations import recommender_for, similar_books
+from .. import autocomplete
+from ..isbn import InvalidISBN, normalize_isbn
+
+router = APIRouter(route_class=ProfiledRoute)
 
-router = APIRouter()
+# one worker per branch so a cross-branch search queries every shard at once
+_search_pool = ThreadPoolExecutor(max_workers=len(engines), thread_name_prefix="branch-search")
 
 @router.get("/", response_model=list[schemas.BookOut])
-def list_books(category: str | None = None, db: Session = Depends(get_db)):
-    q = db.query(models.Book)
+def list_books(category: str | None = None, fast: bool = False, db: Session = Depends(get_read_db)):
+    criteria = []
     if category and category != "all":
-        q = q.filter(models.Book.category == category)
-    return q.all()
+        criteria.append(models.Book.category == category)
+    if fast:
+        return fast_list(db, models.Book, schemas.BookOut, *criteria)
+    return db.query(models.Book).filter(*criteria).all()
+
+@router.get("/autocomplete", response_model=list[schemas.AutocompleteOut])
+def autocomplete_books(q: str = "", limit: int = 10, db: Session = Depends(get_read_db)):
+    """Typo-tolerant title/author suggestions for the search box"""
+    matches = autocomplete.index_for(branch_of(db)).suggest(q, min(limit, 50))
+    if not matches:
+        return []
+    books = {
+        b.id: b for b in db.query(models.Book.id, models.Book.title, models.Book.author)
+        .filter(models.Book.id.in_([book_id for book_id, _ in matches]))
+    }
+    return [
+        schemas.AutocompleteOut(
+            id=book_id,
+            title=books[book_id].title,
+            author=books[book_id].author,
+            match="author" if kind == autocomplete.AUTHOR else "title",
+        )
+        for book_id, kind in matches if book_id in books
+    ]
+
+def _search_branch(branch: str, q: str, category: str | None, limit: int) -> list[schemas.BranchBookOut]:
+    db = read_session_for(branch)
+    try:
+        query = db.query(models.Book).filter(or_(
+            models.Book.title.icontains(q, autoescape=True),
+            models.Book.author.icontains(q, autoescape=True),
+        ))
+        if category and category != "all":
+            query = query.filter(models.Book.category == category)
+        return [
+            schemas.BranchBookOut(branch=branch, **schemas.BookOut.model_validate(book).model_dump())
+            for book in query.order_by(models.Book.title, models.Book.id).limit(limit)
+        ]
+    finally:
+        db.close()
+
+@router.get("/search", response_model=list[schemas.BranchBookOut])
+def search_all_branches(
+    q: str = "",
+    category: str | None = None,
+    branch: list[str] = Query(default=[]),
+    limit: int = 50,
+):
+    """Title/author search across every branch catalog, queried in parallel"""
+    branches = branch or list(engines)
+    unknown = [b for b in branches if b not in engines]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown branch: {unknown[0]}")
+    limit = max(1, min(limit, 200))
+    futures = [_search_pool.submit(_search_branch, b, q.strip(), category, limit) for b in branches]
+    results = [book for future in futures for book in future.result()]
+    results.sort(key=lambda book: (book.title, book.branch, book.id))
+    return results[:limit]
+
+def _set_isbn13(db: Session, book: models.Book, strict: bool = True):
+    """Fill the canonical ISBN-13 key, rejecting bad checksums and duplicates"""
+    if not book.isbn:
+        book.isbn13 = None
+        return
+    try:
+        book.isbn13 = normalize_isbn(book.isbn)
+    except InvalidISBN as e:
+        if strict:
+            raise HTTPException(status_code=400, detail=str(e))
+        book.isbn13 = None
+        return
+    existing = db.query(models.Book.id).filter(
+        models.Book.isbn13 == book.isbn13, models.Book.id != book.id
+    ).first()
+    if existing:
+        raise HTTPException(status_code=400, detail=f"A book with this ISBN already exists (id {existing.id})")
+
+def _commit_book(db: Session, book: models.Book):
+    """Commit, turning a unique-index race on isbn13 into the duplicate error"""
+    isbn13 = book.isbn13
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = db.query(models.Book.id).filter(models.Book.isbn13 == isbn13).first() if isbn13 else None
+        if existing is None:
+            raise
+        raise HTTPException(status_code=400, detail=f"A book with this ISBN already exists (id {existing.id})")
+
+@router.get("/isbn/{isbn}", response_model=schemas.BookOut)
+def get_book_by_isbn(isbn: str, db: Session = Depends(get_read_db)):
+    try:
+        key = normalize_isbn(isbn)
+    except InvalidISBN as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    book = db.query(models.Book).filter(models.Book.isbn13 == key).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return book
 
 @router.get("/{book_id}", response_model=schemas.BookOut)
-def get_book(book_id: int, db: Session = Depends(get_db)):
+def get_book(book_id: int, db: Session = Depends(get_read_db)):
     book = db.query(models.Book).get(book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
     return book
 
+@router.get("/{book_id}/similar", response_model=list[schemas.SimilarBookOut])
+def get_similar_books(book_id: int, limit: int = 10, db: Session = Depends(get_read_db)):
+    """Readers who borrowed this book also borrowed..."""
+    recommender = recommender_for(branch_of(db))
+    if not recommender.available:
+        raise HTTPException(status_code=503, detail="Recommendations unavailable")
+    return similar_books(db, recommender.similar(book_id, limit))
+
 @router.post("/", response_model=schemas.BookOut)
 def create_book(payload: schemas.BookCreate, db: Session = Depends(get_db)):
     book = models.Book(**payload.model_dump())
+    _set_isbn13(db, book)
     db.add(book)
-    db.commit()
+    _commit_book(db, book)
     db.refresh(book)
+    publish_book("book.created", book)
+    autocomplete.index_for(branch_of(db)).add(book.id, book.title, book.author)
     return book
 
 @router.put("/{book_id}", response_model=schemas.BookOut)
@@ -33,10 +154,25 @@ def update_book(book_id: int, payload: schemas.BookUpdate, db: Session = Depends
     book = db.query(models.Book).get(book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
+    old_isbn, was_available = book.isbn, book.available
     for k, v in payload.model_dump(exclude_unset=True).items():
         setattr(book, k, v)
-    db.commit()
+    # legacy rows with an invalid ISBN stay editable as long as it is unchanged
+    _set_isbn13(db, book, strict=book.isbn != old_isbn)
+    handoff = None
+    if book.available and not was_available:
+        # a copy put back on the shelf goes to the head of the hold queue first
+        handoff = holds.hand_off(db, book)
+        if handoff:
+            analytics.record(db, borrows=[(book.id, book.category, handoff[1].borrow_date)])
+    _commit_book(db, book)
     db.refresh(book)
+    publish_book("book.updated", book)
+    autocomplete.index_for(branch_of(db)).update(book.id, book.title, book.author)
+    if handoff:
+        hold, loan = handoff
+        recommender_for(branch_of(db)).record_borrow(hold.user_id, book.id)
+        eventlog.emit(db, holds.fulfilled_events(hold, loan.id, book.category, loan.borrow_date))
     return book
 
 @router.delete("/{book_id}")
@@ -44,6 +180,9 @@ def delete_book(book_id: int, db: Session = Depends(get_db)):
     book = db.query(models.Book).get(book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
+    event = book_event("book.deleted", book.id, book.category, None, branch_of(db))
     db.delete(book)
     db.commit()
+    bus.publish(event)
+    autocomplete.index_for(branch_of(db)).remove(book_id)
     return {"message": "Book deleted"}
@@ -1,19 +1,62 @@
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 
-from ..db import get_db
-from .. import models, schemas
+from ..db import branch_of, get_db, get_read_db
+from .. import analytics, eventlog, holds, models, schemas
+from ..events import bus, book_event, publish_book
+from ..fastjson import fast_list
+from ..holds import LOAN_DAYS
+from ..profiling import ProfiledRoute
+from ..recommendations import recommender_for
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
+
+RESERVED = "Book is reserved for the next reader in the hold queue"
+
+def _queue_position(db: Session, hold: models.Hold) -> int | None:
+    """1-based place in the book's FIFO queue, or None if not waiting"""
+    if hold.status != "waiting":
+        return None
+    return db.query(models.Hold).filter(
+        models.Hold.book_id == hold.book_id,
+        models.Hold.status == "waiting",
+        models.Hold.id <= hold.id,
+    ).count()
+
+def _borrowed_event(loan_id: int, user_id: int, book_id: int, category: str | None, at: datetime) -> dict:
+    return eventlog.event(eventlog.LOAN_BORROWED, user_id, book_id, loan_id, ts=at, category=category)
+
+def _returned_event(loan_id: int, user_id: int, book_id: int, category: str | None,
+                    borrowed_at: datetime, at: datetime) -> dict:
+    return eventlog.event(eventlog.LOAN_RETURNED, user_id, book_id, loan_id, ts=at,
+                          category=category, borrowed_at=borrowed_at.isoformat())
+
+def _hold_event(kind: str, hold: models.Hold, **data) -> dict:
+    return eventlog.event(kind, hold.user_id, hold.book_id, hold.id, **data)
+
+def _batch_result(results: list[schemas.BatchItemResult]) -> schemas.BatchResult:
+    succeeded = sum(1 for r in results if r.success)
+    return schemas.BatchResult(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+def _hold_out(db: Session, hold: models.Hold) -> schemas.HoldOut:
+    out = schemas.HoldOut.model_validate(hold)
+    out.position = _queue_position(db, hold)
+    return out
 
 @router.get("/", response_model=list[schemas.BorrowOut])
-def list_all(db: Session = Depends(get_db)):
+def list_all(fast: bool = False, db: Session = Depends(get_read_db)):
+    if fast:
+        return fast_list(db, models.Borrowing, schemas.BorrowOut)
     return db.query(models.Borrowing).all()
 
 @router.get("/user/{user_id}", response_model=list[schemas.BorrowOut])
-def list_by_user(user_id: int, db: Session = Depends(get_db)):
-    return db.query(models.Borrowing).filter(models.Borrowing.user_id == user_id).all()
+def list_by_user(user_id: int, fast: bool = False, db: Session = Depends(get_read_db)):
+    criterion = models.Borrowing.user_id == user_id
+    if fast:
+        return fast_list(db, models.Borrowing, schemas.BorrowOut, criterion)
+    return db.query(models.Borrowing).filter(criterion).all()
 
 @router.post("/borrow", response_model=schemas.BorrowOut)
 def borrow(payload: schemas.BorrowCreate, db: Session = Depends(get_db)):
@@ -29,6 +72,10 @@ def borrow(payload: schemas.BorrowCreate, db: Session = Depends(get_db)):
     book = db.query(models.Book).get(payload.book_id)
     if not book or not book.available:
         raise HTTPException(status_code=400, detail="Book not available")
+    # while holds wait, only the head of the queue may take the copy
+    head = holds.queue_head(db, book.id)
+    if head and head.user_id != payload.user_id:
+        raise HTTPException(status_code=400, detail=RESERVED)
 
     record = models.Borrowing(
         user_id=payload.user_id,
@@ -36,15 +83,232 @@ def borrow(payload: schemas.BorrowCreate, db: Session = Depends(get_db)):
         book_title=payload.book_title,
         book_author=payload.book_author,
         borrow_date=datetime.utcnow(),
-        return_date=datetime.utcnow() + timedelta(days=14),
+        return_date=datetime.utcnow() + timedelta(days=LOAN_DAYS),
         status="borrowed",
     )
     book.available = False
     db.add(record)
+    if head:
+        db.flush()
+        head.status = "fulfilled"
+        head.borrow_id = record.id
+    analytics.record(db, borrows=[(book.id, book.category, record.borrow_date)])
     db.commit()
     db.refresh(record)
+    publish_book("book.borrowed", book)
+    recommender_for(branch_of(db)).record_borrow(record.user_id, record.book_id)
+    events = [_borrowed_event(record.id, record.user_id, book.id, book.category, record.borrow_date)]
+    if head:
+        events.insert(0, _hold_event("hold.fulfilled", head, borrow_id=record.id))
+    eventlog.emit(db, events)
     return record
 
+@router.post("/borrow/batch", response_model=schemas.BatchResult)
+def borrow_batch(payload: schemas.BatchBorrowCreate, db: Session = Depends(get_db)):
+    """Check out a stack of books for one user in a single transaction"""
+    book_ids = list(dict.fromkeys(payload.book_ids))
+    books = {
+        b.id: b for b in db.query(
+            models.Book.id, models.Book.title, models.Book.author,
+            models.Book.category, models.Book.available,
+        ).filter(models.Book.id.in_(book_ids))
+    }
+    already = {
+        book_id for (book_id,) in db.query(models.Borrowing.book_id).filter(
+            models.Borrowing.user_id == payload.user_id,
+            models.Borrowing.book_id.in_(book_ids),
+            models.Borrowing.status == "borrowed",
+        )
+    }
+
+    errors: dict[int, str] = {}
+    candidates = []
+    for book_id in book_ids:
+        if book_id in already:
+            errors[book_id] = "Book already borrowed by this user"
+        elif book_id not in books or not books[book_id].available:
+            errors[book_id] = "Book not available"
+        else:
+            candidates.append(book_id)
+    # while holds wait, only the head of the queue may take the copy
+    heads = holds.queue_heads(db, candidates)
+    for book_id, hold in heads.items():
+        if hold.user_id != payload.user_id:
+            errors[book_id] = RESERVED
+            candidates.remove(book_id)
+
+    # claim every candidate with one UPDATE; rows taken concurrently drop out
+    claimed = set()
+    if candidates:
+        claimed = set(db.scalars(
+            update(models.Book)
+            .where(models.Book.id.in_(candidates), models.Book.available == True)  # noqa: E712
+            .values(available=False)
+            .returning(models.Book.id),
+            execution_options={"synchronize_session": False},
+        ))
+    for book_id in candidates:
+        if book_id not in claimed:
+            errors[book_id] = "Book not available"
+
+    loans: dict[int, int] = {}
+    if claimed:
+        now = datetime.utcnow()
+        rows = [
+            {
+                "user_id": payload.user_id,
+                "book_id": book_id,
+                "book_title": books[book_id].title,
+                "book_author": books[book_id].author,
+                "borrow_date": now,
+                "return_date": now + timedelta(days=LOAN_DAYS),
+                "status": "borrowed",
+            }
+            for book_id in candidates if book_id in claimed
+        ]
+        loans = {
+            book_id: borrow_id for borrow_id, book_id in db.execute(
+                insert(models.Borrowing)
+                .returning(models.Borrowing.id, models.Borrowing.book_id, sort_by_parameter_order=True),
+                rows,
+            )
+        }
+        analytics.record(db, borrows=[(book_id, books[book_id].category, now) for book_id in loans])
+    fulfilled = {book_id: heads[book_id] for book_id in loans if book_id in heads}
+    for book_id, hold in fulfilled.items():
+        hold.status = "fulfilled"
+        hold.borrow_id = loans[book_id]
+    db.commit()
+
+    branch = branch_of(db)
+    recommender = recommender_for(branch)
+    for book_id in loans:
+        bus.publish(book_event("book.borrowed", book_id, books[book_id].category, False, branch))
+        recommender.record_borrow(payload.user_id, book_id)
+    eventlog.emit(db, [
+        _hold_event("hold.fulfilled", hold, borrow_id=loans[book_id]) for book_id, hold in fulfilled.items()
+    ] + [
+        _borrowed_event(borrow_id, payload.user_id, book_id, books[book_id].category, now)
+        for book_id, borrow_id in loans.items()
+    ])
+    return _batch_result([
+        schemas.BatchItemResult(id=book_id, success=True, borrow_id=loans[book_id])
+        if book_id in loans else
+        schemas.BatchItemResult(id=book_id, success=False, detail=errors[book_id])
+        for book_id in book_ids
+    ])
+
+@router.put("/return/batch", response_model=schemas.BatchResult)
+def return_batch(payload: schemas.BatchReturnRequest, db: Session = Depends(get_db)):
+    """Check in a stack of loans in a single transaction, honouring hold queues"""
+    borrow_ids = list(dict.fromkeys(payload.borrow_ids))
+    found = {
+        r.id: r for r in db.query(models.Borrowing.id, models.Borrowing.status).filter(
+            models.Borrowing.id.in_(borrow_ids)
+        )
+    }
+
+    errors: dict[int, str] = {}
+    candidates = []
+    for borrow_id in borrow_ids:
+        if borrow_id not in found:
+            errors[borrow_id] = "Borrowing record not found"
+        elif found[borrow_id].status == "returned":
+            errors[borrow_id] = "Book already returned"
+        else:
+            candidates.append(borrow_id)
+
+    now = datetime.utcnow()
+    returned: dict[int, int] = {}
+    borrowed_at: dict[int, datetime] = {}
+    borrower: dict[int, int] = {}
+    if candidates:
+        for borrow_id, book_id, borrow_date, user_id in db.execute(
+            update(models.Borrowing)
+            .where(models.Borrowing.id.in_(candidates), models.Borrowing.status == "borrowed")
+            .values(status="returned", return_date=now)
+            .returning(
+                models.Borrowing.id, models.Borrowing.book_id,
+                models.Borrowing.borrow_date, models.Borrowing.user_id,
+            ),
+            execution_options={"synchronize_session": False},
+        ):
+            returned[borrow_id] = book_id
+            borrowed_at[borrow_id] = borrow_date
+            borrower[borrow_id] = user_id
+    for borrow_id in candidates:
+        if borrow_id not in returned:
+            errors[borrow_id] = "Book already returned"
+
+    book_ids = set(returned.values())
+    books = {
+        b.id: b for b in db.query(
+            models.Book.id, models.Book.title, models.Book.author, models.Book.category
+        ).filter(models.Book.id.in_(book_ids))
+    }
+
+    # head of each book's hold queue gets the copy, the rest become available
+    heads = holds.queue_heads(db, books)
+
+    if heads:
+        loans = db.execute(
+            insert(models.Borrowing)
+            .returning(models.Borrowing.id, sort_by_parameter_order=True),
+            [
+                {
+                    "user_id": hold.user_id,
+                    "book_id": book_id,
+                    "book_title": books[book_id].title,
+                    "book_author": books[book_id].author,
+                    "borrow_date": now,
+                    "return_date": now + timedelta(days=LOAN_DAYS),
+                    "status": "borrowed",
+                }
+                for book_id, hold in heads.items()
+            ],
+        ).scalars().all()
+        for hold, loan_id in zip(heads.values(), loans):
+            hold.status = "fulfilled"
+            hold.borrow_id = loan_id
+
+    freed = [book_id for book_id in books if book_id not in heads]
+    if freed:
+        db.execute(
+            update(models.Book).where(models.Book.id.in_(freed)).values(available=True),
+            execution_options={"synchronize_session": False},
+        )
+    category = {book_id: book.category for book_id, book in books.items()}
+    analytics.record(
+        db,
+        borrows=[(book_id, category[book_id], now) for book_id in heads],
+        returns=[
+            (book_id, category.get(book_id), borrowed_at[borrow_id], now)
+            for borrow_id, book_id in returned.items()
+        ],
+    )
+    db.commit()
+
+    branch = branch_of(db)
+    recommender = recommender_for(branch)
+    for book_id, book in books.items():
+        bus.publish(book_event("book.returned", book_id, book.category, book_id not in heads, branch))
+    for book_id, hold in heads.items():
+        recommender.record_borrow(hold.user_id, book_id)
+    eventlog.emit(db, [
+        _returned_event(borrow_id, borrower[borrow_id], book_id, category.get(book_id), borrowed_at[borrow_id], now)
+        for borrow_id, book_id in returned.items()
+    ] + [
+        event
+        for book_id, hold in heads.items()
+        for event in holds.fulfilled_events(hold, hold.borrow_id, category[book_id], now)
+    ])
+    return _batch_result([
+        schemas.BatchItemResult(id=borrow_id, success=True, borrow_id=borrow_id)
+        if borrow_id in returned else
+        schemas.BatchItemResult(id=borrow_id, success=False, detail=errors[borrow_id])
+        for borrow_id in borrow_ids
+    ])
+
 @router.put("/return/{borrow_id}", response_model=schemas.BorrowOut)
 def return_book(borrow_id: int, db: Session = Depends(get_db)):
     record = db.query(models.Borrowing).get(borrow_id)
@@ -55,19 +319,96 @@ def return_book(borrow_id: int, db: Session = Depends(get_db)):
     record.status = "returned"
     record.return_date = datetime.utcnow()
 
-    # mark book available
     book = db.query(models.Book).get(record.book_id)
-    if book:
-        book.available = True
+    # hand the copy to the head of the hold queue in the same transaction,
+    # otherwise mark the book available
+    handoff = holds.hand_off(db, book) if book else None
 
+    category = book.category if book else None
+    analytics.record(
+        db,
+        borrows=[(book.id, category, handoff[1].borrow_date)] if handoff else [],
+        returns=[(record.book_id, category, record.borrow_date, record.return_date)],
+    )
     db.commit()
     db.refresh(record)
+    if book:
+        publish_book("book.returned", book)
+    events = [_returned_event(
+        record.id, record.user_id, record.book_id, category, record.borrow_date, record.return_date
+    )]
+    if handoff:
+        head, loan = handoff
+        recommender_for(branch_of(db)).record_borrow(head.user_id, head.book_id)
+        events += holds.fulfilled_events(head, loan.id, category, loan.borrow_date)
+    eventlog.emit(db, events)
     return record
 
 @router.get("/overdue", response_model=list[schemas.BorrowOut])
-def overdue(db: Session = Depends(get_db)):
+def overdue(fast: bool = False, db: Session = Depends(get_read_db)):
     now = datetime.utcnow()
-    return db.query(models.Borrowing).filter(
+    criteria = (
         models.Borrowing.status == "borrowed",
         models.Borrowing.return_date < now,
-    ).all()
+    )
+    if fast:
+        return fast_list(db, models.Borrowing, schemas.BorrowOut, *criteria)
+    return db.query(models.Borrowing).filter(*criteria).all()
+
+# Hold queue endpoints
+@router.post("/holds", response_model=schemas.HoldOut)
+def place_hold(payload: schemas.HoldCreate, db: Session = Depends(get_db)):
+    """Join the FIFO queue for a book that is currently out"""
+    book = db.query(models.Book).get(payload.book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found")
+    if book.available:
+        raise HTTPException(status_code=400, detail="Book is available, borrow it directly")
+
+    borrowed = db.query(models.Borrowing).filter(
+        models.Borrowing.user_id == payload.user_id,
+        models.Borrowing.book_id == payload.book_id,
+        models.Borrowing.status == "borrowed",
+    ).first()
+    if borrowed:
+        raise HTTPException(status_code=400, detail="Book already borrowed by this user")
+
+    existing = db.query(models.Hold).filter(
+        models.Hold.user_id == payload.user_id,
+        models.Hold.book_id == payload.book_id,
+        models.Hold.status == "waiting",
+    ).first()
+    if existing:
+        raise HTTPException(status_code=400, detail="Book already on hold for this user")
+
+    hold = models.Hold(user_id=payload.user_id, book_id=payload.book_id, status="waiting")
+    db.add(hold)
+    db.commit()
+    db.refresh(hold)
+    eventlog.emit(db, [_hold_event("hold.placed", hold)])
+    return _hold_out(db, hold)
+
+@router.get("/holds/user/{user_id}", response_model=list[schemas.HoldOut])
+def list_holds_by_user(user_id: int, db: Session = Depends(get_read_db)):
+    holds = db.query(models.Hold).filter(models.Hold.user_id == user_id).order_by(models.Hold.id).all()
+    return [_hold_out(db, h) for h in holds]
+
+@router.get("/holds/{hold_id}", response_model=schemas.HoldOut)
+def get_hold(hold_id: int, db: Session = Depends(get_read_db)):
+    hold = db.query(models.Hold).get(hold_id)
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    return _hold_out(db, hold)
+
+@router.delete("/holds/{hold_id}", response_model=schemas.HoldOut)
+def cancel_hold(hold_id: int, db: Session = Depends(get_db)):
+    hold = db.query(models.Hold).get(hold_id)
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    if hold.status != "waiting":
+        raise HTTPException(status_code=400, detail="Hold is no longer waiting")
+    hold.status = "cancelled"
+    db.commit()
+    db.refresh(hold)
+    eventlog.emit(db, [_hold_event("hold.cancelled", hold)])
+    return _hold_out(db, hold)
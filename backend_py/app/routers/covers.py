@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+from ..db import request_branch, session_for
+from .. import models
+from ..covers import CoverFetchError, cover_key, get_cache, snap_width
+
+router = APIRouter()
+
+def _book_image(branch: str, book_id: int) -> str:
+    # short-lived session so no pooled connection is held while the cover downloads
+    db = session_for(branch)
+    try:
+        book = db.query(models.Book).get(book_id)
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+        return book.image
+    finally:
+        db.close()
+
+@router.get("/{book_id}")
+async def get_cover(book_id: int, request: Request, w: int | None = None, v: str | None = None):
+    """Resized, locally cached copy of a book's remote cover image.
+
+    Pass `v` (the `X-Cover-Version` header of an earlier response) to get an
+    immutable, year-long cacheable URL; without it the response is cached
+    for an hour so a changed `Book.image` is picked up.
+    """
+    image = await run_in_threadpool(_book_image, request_branch(request), book_id)
+    if not image or not image.startswith(("http://", "https://")):
+        raise HTTPException(status_code=404, detail="No remote cover for this book")
+
+    width = snap_width(w)
+    fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    try:
+        data, media_type = await get_cache().read(image, width, fmt)
+    except CoverFetchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    version = cover_key(image)
+    if v == version:
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = "public, max-age=3600"
+    return Response(
+        data,
+        media_type=media_type,
+        headers={
+            "Cache-Control": cache_control,
+            "Vary": "Accept",
+            "X-Cover-Version": version,
+        },
+    )
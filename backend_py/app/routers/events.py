@@ -0,0 +1,80 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from ..db import engines, get_read_db, request_branch
+from .. import eventlog, models, schemas
+from ..events import bus
+from .users import get_current_admin
+
+router = APIRouter()
+
+KEEPALIVE_SECONDS = 15
+
+@router.get("/books")
+async def book_events(
+    request: Request,
+    book_id: list[int] = Query(default=[]),
+    category: list[str] = Query(default=[]),
+):
+    """Server-Sent Events stream of book availability deltas.
+
+    Filter with repeated `book_id` / `category` query params; no filter means
+    every book of the request's branch. Slow consumers are disconnected and
+    should reconnect and re-fetch the catalog.
+    """
+    branch = request_branch(request)
+    if branch not in engines:
+        raise HTTPException(status_code=404, detail=f"Unknown branch: {branch}")
+    sub = bus.subscribe(book_ids=book_id, categories=category, branch=branch)
+
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    yield "event: dropped\ndata: {}\n\n"
+                    break
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/log", response_model=list[schemas.EventLogOut], dependencies=[Depends(get_current_admin)])
+def read_event_log(
+    after_id: int = 0,
+    limit: int = 100,
+    type: list[str] = Query(default=[]),
+    db: Session = Depends(get_read_db),
+):
+    """Page through the append-only event log in order; pass the last `id`
+    seen as `after_id` to tail it"""
+    q = db.query(models.EventLogEntry).filter(models.EventLogEntry.id > after_id)
+    if type:
+        q = q.filter(models.EventLogEntry.type.in_(type))
+    return [
+        schemas.EventLogOut(
+            id=e.id, ts=e.ts, type=e.type, user_id=e.user_id, book_id=e.book_id, ref_id=e.ref_id,
+            data=json.loads(e.data) if e.data else None,
+        )
+        for e in q.order_by(models.EventLogEntry.id).limit(max(1, min(limit, 1000)))
+    ]
+
+@router.get("/log/stats", dependencies=[Depends(get_current_admin)])
+def event_log_stats():
+    """Write-behind queue depth and written/waited/failed counters"""
+    return eventlog.log.stats()
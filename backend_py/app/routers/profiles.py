@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from ..profiling import store
+from .users import get_current_admin
+
+router = APIRouter(dependencies=[Depends(get_current_admin)])
+
+@router.get("/")
+def list_profiles():
+    """Stored request profiles, newest first"""
+    return store.list()
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str):
+    profile = store.load(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@router.get("/{profile_id}/folded", response_class=PlainTextResponse)
+def get_profile_folded(profile_id: str):
+    """Collapsed stacks, for flamegraph.pl or speedscope"""
+    profile = store.load(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile["folded"]
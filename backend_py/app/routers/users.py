@@ -1,25 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Form
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 import os
 import shutil
 from typing import Optional
+import math
 import random
 import string
 
-from ..db import get_db, hash_password, verify_password
-from .. import models, schemas
-
-router = APIRouter()
+from ..db import DEFAULT_BRANCH, branch_of, get_db, get_read_db, hash_password
+from .. import eventlog, models, schemas
+from ..fastjson import fast_list
+from ..profiling import ProfiledRoute
+from ..recommendations import recommender_for, similar_books
+from ..security import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    SECRET_KEY,
+    HashPoolBusy,
+    client_address,
+    hash_password_async,
+    verify_and_update_async,
+    ip_limiter,
+    known_logins,
+    username_limiter,
+)
+
+router = APIRouter(route_class=ProfiledRoute)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/login")
 
-# JWT configuration
-SECRET_KEY = os.getenv("JWT_SECRET", "your-secret-key")  # Change in production
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
-
 # In-memory OTP storage (use Redis/database in production)
 otp_storage = {}
 
@@ -57,8 +69,20 @@ def verify_otp(username: str, otp: str) -> bool:
 
     return False
 
+def too_many_attempts(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many login attempts, try again later",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+def hash_pool_busy() -> HTTPException:
+    return HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+
 @router.get("/", response_model=list[schemas.UserOut])
-def list_users(db: Session = Depends(get_db)):
+def list_users(fast: bool = False, db: Session = Depends(get_db)):
+    if fast:
+        return fast_list(db, models.User, schemas.UserOut)
     return db.query(models.User).all()
 
 @router.post("/register", response_model=schemas.TokenResponse)
@@ -89,13 +113,20 @@ async def register_user(
     if existing:
         raise HTTPException(status_code=400, detail="Email already exists")
 
+    # End the read transaction so no pooled connection is held while hashing
+    db.rollback()
+    try:
+        password_hash = await hash_password_async(payload.password)
+    except HashPoolBusy:
+        raise hash_pool_busy()
+
     # Create user first without avatar
     user = models.User(
         username=payload.username,
         email=payload.email,
         name=payload.name or payload.username,
         mobile=payload.mobile,
-        password_hash=hash_password(payload.password),
+        password_hash=password_hash,
         email_verified=True  # Auto-verify new users
     )
     db.add(user)
@@ -133,8 +164,10 @@ async def register_user(
     # In development mode, return verification URL
     verification_url = f"http://localhost:3000/pages/verify-email.html?token={verification_token}"
 
+    await run_in_threadpool(eventlog.emit, db, [eventlog.event("auth.registered", user.id)])
+
     # Return token for immediate login (user can still use app, but needs to verify email)
-    token = create_access_token({"sub": user.username})
+    token = create_access_token({"sub": user.username, "branch": branch_of(db), "role": user.role})
 
     return {
         "success": True,
@@ -143,7 +176,7 @@ async def register_user(
         "user": user
     }
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _user_for_token(token: str, db: Session) -> models.User:
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -154,6 +187,9 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
+        # a username only names a user within the branch that issued the token
+        if payload.get("branch", DEFAULT_BRANCH) != branch_of(db):
+            raise credentials_exception
     except JWTError:
         raise credentials_exception
     
@@ -162,23 +198,68 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         raise credentials_exception
     return user
 
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return _user_for_token(token, db)
+
+def get_current_user_read(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    """get_current_user for read-only routes: resolves the user on the route's read session"""
+    return _user_for_token(token, db)
+
+def get_current_admin(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 @router.post("/login", response_model=schemas.TokenResponse)
-def login(
+async def login(
+    request: Request,
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
 ):
     payload = schemas.LoginRequest(username=username, password=password)
+
+    # Throttle before doing any password hashing work
+    client_ip = client_address(request)
+    wait = ip_limiter.retry_after(client_ip)
+    if (payload.username, client_ip) not in known_logins:
+        wait = max(wait, username_limiter.retry_after(payload.username))
+    if wait > 0:
+        raise too_many_attempts(wait)
+
     user = db.query(models.User).filter(models.User.username == payload.username).first()
-    if not user or not verify_password(payload.password, user.password_hash):
+    ok, new_hash = False, None
+    if user:
+        stored = user.password_hash
+        # End the read transaction so no pooled connection is held while hashing
+        db.rollback()
+        try:
+            ok, new_hash = await verify_and_update_async(payload.password, stored)
+        except HashPoolBusy:
+            raise hash_pool_busy()
+    if not ok:
+        ip_limiter.consume(client_ip)
+        username_limiter.consume(payload.username)
+        await run_in_threadpool(eventlog.emit, db, [eventlog.event(
+            "auth.login_failed", user.id if user else None, username=payload.username, ip=client_ip
+        )])
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    known_logins.add(payload.username, client_ip)
+
+    # Upgrade legacy plain text (or outdated) hashes transparently
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+        db.refresh(user)
 
     # Email verification disabled - all users can login
     # if not user.email_verified and user.role != "admin":
     #     raise HTTPException(status_code=403, detail="Email not verified")
 
+    await run_in_threadpool(eventlog.emit, db, [eventlog.event("auth.login", user.id, ip=client_ip)])
+
     # Generate token
-    token = create_access_token({"sub": user.username})
+    token = create_access_token({"sub": user.username, "branch": branch_of(db), "role": user.role})
     return {
         "success": True,
         "token": token,
@@ -186,9 +267,21 @@ def login(
     }
 
 @router.get("/me", response_model=schemas.UserOut)
-def get_current_user_profile(current_user: models.User = Depends(get_current_user)):
+def get_current_user_profile(current_user: models.User = Depends(get_current_user_read)):
     return current_user
 
+@router.get("/me/recommendations", response_model=list[schemas.SimilarBookOut])
+def get_recommendations(
+    limit: int = 10,
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """Books co-borrowed with the current user's borrowing history"""
+    recommender = recommender_for(branch_of(db))
+    if not recommender.available:
+        raise HTTPException(status_code=503, detail="Recommendations unavailable")
+    return similar_books(db, recommender.recommend_for_user(current_user.id, limit))
+
 @router.put("/me", response_model=schemas.UserOut)
 async def update_current_user(
     name: Optional[str] = Form(None),
@@ -401,8 +494,8 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
 # Wishlist endpoints
 @router.get("/wishlist")
 def get_wishlist(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
 ):
     """Get user's wishlist"""
     wishlist_items = db.query(models.Wishlist).filter(
@@ -457,6 +550,9 @@ def add_to_wishlist(
     db.add(wishlist_item)
     db.commit()
     db.refresh(wishlist_item)
+    eventlog.emit(db, [
+        eventlog.event("wishlist.added", current_user.id, book_id, wishlist_item.id)
+    ])
     
     return {
         "success": True,
@@ -485,8 +581,12 @@ def remove_from_wishlist(
     if not wishlist_item:
         raise HTTPException(status_code=404, detail="Book not found in wishlist")
     
+    item_id = wishlist_item.id
     db.delete(wishlist_item)
     db.commit()
+    eventlog.emit(db, [
+        eventlog.event("wishlist.removed", current_user.id, book_id, item_id)
+    ])
     
     return {
         "success": True,
@@ -496,8 +596,8 @@ def remove_from_wishlist(
 @router.get("/wishlist/check/{book_id}")
 def check_wishlist(
     book_id: int,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
 ):
     """Check if book is in user's wishlist"""
     wishlist_item = db.query(models.Wishlist).filter(
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
 
 # Users
 class UserBase(BaseModel):
@@ -82,10 +82,23 @@ class BookUpdate(BookBase):
 
 class BookOut(BookBase):
     id: int
+    isbn13: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class AutocompleteOut(BaseModel):
+    id: int
+    title: str
+    author: str
+    match: str  # title/author
+
+class SimilarBookOut(BookOut):
+    score: int  # number of readers who borrowed both
+
+class BranchBookOut(BookOut):
+    branch: str
+
 # Borrowing
 class BorrowCreate(BaseModel):
     user_id: int
@@ -122,3 +135,78 @@ class WishlistOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+# Holds
+class HoldCreate(BaseModel):
+    user_id: int
+    book_id: int
+
+class HoldOut(BaseModel):
+    id: int
+    user_id: int
+    book_id: int
+    created_at: datetime
+    status: str
+    borrow_id: Optional[int] = None
+    position: Optional[int] = None  # 1 = next in line; None once no longer waiting
+
+    class Config:
+        from_attributes = True
+
+# Batch circulation
+class BatchBorrowCreate(BaseModel):
+    user_id: int
+    book_ids: list[int]
+
+class BatchReturnRequest(BaseModel):
+    borrow_ids: list[int]
+
+class BatchItemResult(BaseModel):
+    id: int  # book id for checkout, borrow id for check-in
+    success: bool
+    borrow_id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BatchResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: list[BatchItemResult]
+
+# Circulation analytics
+class CirculationSummaryOut(BaseModel):
+    start: date
+    end: date
+    borrows: int
+    returns: int
+    avg_loan_days: Optional[float] = None  # over loans returned in the range
+
+class DailyCirculationOut(BaseModel):
+    day: date
+    borrows: int
+    returns: int
+    avg_loan_days: Optional[float] = None
+
+class CategoryPeriodOut(BaseModel):
+    period: date  # first day of the day/week/month bucket
+    category: str
+    borrows: int
+    returns: int
+    avg_loan_days: Optional[float] = None
+
+class TopBookOut(BaseModel):
+    book_id: int
+    title: Optional[str] = None  # None once the book is deleted
+    author: Optional[str] = None
+    borrows: int
+    returns: int
+    avg_loan_days: Optional[float] = None
+
+# Event log
+class EventLogOut(BaseModel):
+    id: int
+    ts: datetime
+    type: str
+    user_id: Optional[int] = None
+    book_id: Optional[int] = None
+    ref_id: Optional[int] = None
+    data: Optional[dict] = None
@@ -0,0 +1,187 @@
+"""Password hashing, login throttling and token settings.
+
+Hashes use passlib's pbkdf2_sha256 (hashlib-backed, releases the GIL) and
+run on a small dedicated thread pool so KDF work never blocks the event
+loop and cannot grow past a fixed number of cores. Rows still holding
+legacy plain text passwords verify once and are rehashed on login.
+"""
+import asyncio
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+
+# JWT configuration, shared by the users router and the middleware that reads
+# tokens before routing (branch selection, profiling, admission control)
+SECRET_KEY = os.getenv("JWT_SECRET", "your-secret-key")  # Change in production
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__rounds=int(os.getenv("PASSWORD_HASH_ROUNDS", "29000")),
+)
+
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# hash jobs allowed in flight (running + queued) before logins are shed
+HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(HASH_WORKERS * 8)))
+
+TRUSTED_PROXIES = frozenset(p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip())
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pwhash")
+_pending = 0
+_pending_lock = threading.Lock()
+
+class HashPoolBusy(Exception):
+    pass
+
+def bearer_claims(headers: Iterable[tuple[bytes, bytes]]) -> Optional[dict]:
+    """Claims of an ASGI request's bearer token; None when absent or invalid"""
+    for name, value in headers:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            except JWTError:
+                # left for get_current_user to reject
+                return None
+    return None
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_and_update(password: str, stored: str) -> tuple[bool, Optional[str]]:
+    """Verify a password; returns (ok, new_hash) where new_hash is set when the
+    stored value is legacy plain text or uses outdated parameters"""
+    if not stored:
+        return False, None
+    if pwd_context.identify(stored) is None:
+        # legacy plain text row
+        if hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")):
+            return True, pwd_context.hash(password)
+        return False, None
+    return pwd_context.verify_and_update(password, stored)
+
+def verify_password(password: str, stored: str) -> bool:
+    return verify_and_update(password, stored)[0]
+
+def _reserve():
+    global _pending
+    with _pending_lock:
+        if _pending >= HASH_MAX_PENDING:
+            raise HashPoolBusy()
+        _pending += 1
+
+def _release():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+async def _run(fn, *args):
+    _reserve()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _release()
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+async def verify_and_update_async(password: str, stored: str) -> tuple[bool, Optional[str]]:
+    return await _run(verify_and_update, password, stored)
+
+def client_address(request) -> str:
+    """Address of the client, looking through X-Forwarded-For when the peer is a
+    proxy listed in TRUSTED_PROXIES"""
+    peer = request.client.host if request.client else "unknown"
+    if peer not in TRUSTED_PROXIES:
+        return peer
+    # the rightmost hop that is not one of our proxies; earlier hops are client supplied
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if hop not in TRUSTED_PROXIES:
+            return hop
+    return peer
+
+class TokenBucketLimiter:
+    """In-memory token buckets keyed by string (IP, username...).
+
+    Each key holds at most `capacity` tokens refilled at `rate` per second.
+    Only the `max_keys` most recently used keys are kept, so memory stays
+    bounded under spraying from many sources.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refilled(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key: str) -> float:
+        """Seconds until `key` has a token again (0 if it has one now)"""
+        with self._lock:
+            tokens = self._refilled(key, time.monotonic())
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refilled(key, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+class KnownLogins:
+    """(username, address) pairs that logged in successfully, so the owner of an
+    account under attack can still get in from where they usually log in.
+    Only the `max_keys` most recent pairs are kept."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._pairs: OrderedDict[tuple[str, str], None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, username: str, address: str):
+        with self._lock:
+            self._pairs[(username, address)] = None
+            self._pairs.move_to_end((username, address))
+            while len(self._pairs) > self.max_keys:
+                self._pairs.popitem(last=False)
+
+    def __contains__(self, pair: tuple[str, str]) -> bool:
+        with self._lock:
+            return pair in self._pairs
+
+# Only failed attempts cost tokens, so a busy proxy or office address is not
+# throttled for logging people in. The username bucket is shared by every
+# address and bounds guessing at one account from many sources; it is skipped
+# for addresses in known_logins, so it slows an attack without locking out
+# the account.
+ip_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("LOGIN_IP_RATE", "1")),
+    capacity=float(os.getenv("LOGIN_IP_BURST", "30")),
+)
+username_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("LOGIN_USER_RATE", "0.1")),
+    capacity=float(os.getenv("LOGIN_USER_BURST", "10")),
+)
+known_logins = KnownLogins()
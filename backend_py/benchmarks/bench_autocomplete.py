@@ -0,0 +1,68 @@
+"""Autocomplete index: build time, per-keystroke latency and memory budget.
+
+Run from backend_py/:
+
+    python -m benchmarks.bench_autocomplete [titles]
+
+Builds the index over a synthetic catalog of generated titles and authors,
+then replays every prefix of sampled titles as if typed one key at a time.
+"""
+import random
+import sys
+import time
+
+from app.autocomplete import AutocompleteIndex
+
+WORDS = (
+    "the a of and in to lost city night dark love secret house garden river war "
+    "king queen dragon shadow light star sea moon fire stone winter summer road "
+    "last first heart time dream blood silver golden empire ghost island forest "
+    "journey return rise fall world voice song storm wind mountain child letter "
+    "memory mirror hunter thief witch crown ocean desert bridge tower edge"
+).split()
+FIRST = "sarah james emily mike patricia robert david sofia thomas lisa anna omar ravi mei".split()
+LAST = "mitchell anderson roberts turner blake king chen garcia wright chang iyer okafor".split()
+
+def catalog(n: int, seed: int = 3):
+    rng = random.Random(seed)
+    for book_id in range(1, n + 1):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+        title += f" {rng.randint(1, 99999)}" if rng.random() < 0.5 else ""
+        author = f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+        yield book_id, title.title(), author.title()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    docs = list(catalog(n))
+
+    index = AutocompleteIndex()
+    start = time.perf_counter()
+    index.build(docs)
+    print(f"titles: {n}  build: {time.perf_counter() - start:.1f} s")
+
+    print("memory budget:")
+    for name, value in index.stats().items():
+        unit = f"{value / 2**20:9.2f} MiB" if not name.endswith("_count") else f"{value:9d}"
+        print(f"  {name:12s} {unit}")
+
+    rng = random.Random(5)
+    samples = [rng.choice(docs) for _ in range(500)]
+    keystrokes = [title.lower()[:i] for _, title, _ in samples for i in range(1, len(title) + 1)]
+    start = time.perf_counter()
+    for q in keystrokes:
+        index.suggest(q, 10)
+    exact = (time.perf_counter() - start) / len(keystrokes)
+    print(f"per keystroke (exact prefixes) : {exact * 1e3:.3f} ms over {len(keystrokes)} queries")
+
+    def typo(s: str) -> str:
+        i = rng.randrange(1, len(s))
+        return s[:i] + "x" + s[i + 1:]
+    typos = [typo(title.lower().split()[0]) for _, title, _ in samples if len(title.split()[0]) > 3]
+    start = time.perf_counter()
+    for q in typos:
+        index.suggest(q, 10)
+    fuzzy = (time.perf_counter() - start) / len(typos)
+    print(f"per keystroke (with a typo)    : {fuzzy * 1e3:.3f} ms over {len(typos)} queries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Per-row serialization cost of list endpoints: default path vs `?fast=true`.
+
+Run from backend_py/:
+
+    python -m benchmarks.bench_list_serialization [rows]
+
+Uses a throwaway in-memory SQLite database. The default path mirrors what
+FastAPI does for a `response_model=list[...]` route: load ORM objects,
+validate each through the Pydantic schema, run `jsonable_encoder`, then
+encode with the stdlib JSON encoder.
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models, schemas
+from app.db import Base
+from app.fastjson import FastJSONResponse, fast_rows
+
+def seed(db, n: int):
+    now = datetime.utcnow()
+    db.add(models.User(username="bench", email="bench@library.com", password_hash="x"))
+    db.flush()
+    db.bulk_save_objects([
+        models.Book(
+            title=f"Book {i}", author=f"Author {i % 500}", category="fiction",
+            image="https://example.com/cover.jpg", description="A book used for benchmarking.",
+            isbn=f"978-{i:010d}", published_year=2000 + i % 25, available=True,
+        )
+        for i in range(n)
+    ])
+    db.bulk_save_objects([
+        models.Borrowing(
+            user_id=1, book_id=i + 1, book_title=f"Book {i}", book_author=f"Author {i % 500}",
+            borrow_date=now, return_date=now + timedelta(days=14), status="borrowed",
+        )
+        for i in range(n)
+    ])
+    db.commit()
+
+def default_path(db, model, schema) -> bytes:
+    objs = db.query(model).all()
+    validated = TypeAdapter(list[schema]).validate_python(objs, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+def fast_path(db, model, schema) -> bytes:
+    return FastJSONResponse(fast_rows(db, model, schema)).body
+
+def timed(fn, *args, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    seed(db, n)
+
+    print(f"rows: {n}")
+    for name, model, schema in (
+        ("books", models.Book, schemas.BookOut),
+        ("borrowing", models.Borrowing, schemas.BorrowOut),
+    ):
+        db.expunge_all()
+        before = timed(default_path, db, model, schema)
+        db.expunge_all()
+        after = timed(fast_path, db, model, schema)
+        print(
+            f"{name:10s} default {before / n * 1e6:7.2f} us/row   "
+            f"fast {after / n * 1e6:7.2f} us/row   speedup {before / after:4.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
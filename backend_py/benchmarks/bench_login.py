@@ -0,0 +1,52 @@
+"""Password verification throughput: logins per second per core.
+
+Run from backend_py/:
+
+    python -m benchmarks.bench_login [seconds]
+
+Measures `verify_and_update` on one thread (per-core cost) and through the
+bounded hash pool used by the login route (whole-machine throughput).
+"""
+import asyncio
+import sys
+import time
+
+from app import security
+
+def single_core(stored: str, seconds: float) -> float:
+    n = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        security.verify_and_update("correct horse", stored)
+        n += 1
+    return n / (time.perf_counter() - start)
+
+def pooled(stored: str, seconds: float) -> float:
+    # concurrent logins awaiting the pool, the way the async login route does
+    async def run() -> int:
+        callers = security.HASH_WORKERS * 2
+        n = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            await asyncio.gather(*(
+                security.verify_and_update_async("correct horse", stored) for _ in range(callers)
+            ))
+            n += callers
+        return n
+
+    start = time.perf_counter()
+    n = asyncio.run(run())
+    return n / (time.perf_counter() - start)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    stored = security.hash_password("correct horse")
+    print(f"scheme: {security.pwd_context.identify(stored)}  rounds: {stored.split('$')[2]}")
+    per_core = single_core(stored, seconds)
+    print(f"single thread : {per_core:8.1f} logins/s per core ({1000 / per_core:.2f} ms each)")
+    total = pooled(stored, seconds)
+    print(f"hash pool x{security.HASH_WORKERS:<3d}: {total:8.1f} logins/s "
+          f"({total / security.HASH_WORKERS:.1f} per worker)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Co-borrow index: full rebuild time, incremental update and read latency.
+
+Run from backend_py/:
+
+    python -m benchmarks.bench_recommendations [borrow_rows]
+
+Generates synthetic borrowing history (Zipf-like book popularity) in memory,
+so it measures the index itself rather than the SQL query that feeds it.
+"""
+import sys
+import time
+
+import numpy as np
+
+from app.recommendations import CoBorrowIndex
+
+def synthetic(rows: int, users: int, books: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(1, users + 1, size=rows, dtype=np.int64)
+    popularity = 1.0 / np.arange(1, books + 1) ** 0.8
+    popularity /= popularity.sum()
+    book_ids = rng.choice(np.arange(1, books + 1, dtype=np.int64), size=rows, p=popularity)
+    return user_ids, book_ids
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users, books = max(1, rows // 10), max(1, rows // 20)
+    user_ids, book_ids = synthetic(rows, users, books)
+    print(f"borrow rows: {rows}  users: {users}  books: {books}")
+
+    index = CoBorrowIndex()
+    start = time.perf_counter()
+    index.build(user_ids, book_ids)
+    print(f"full rebuild      : {time.perf_counter() - start:8.2f} s  "
+          f"(co-borrow nnz {index._co.nnz})")
+
+    rng = np.random.default_rng(11)
+    new_users = rng.integers(1, users + 1, size=1000)
+    new_books = rng.integers(1, books + 1, size=1000)
+    start = time.perf_counter()
+    for u, b in zip(new_users.tolist(), new_books.tolist()):
+        index.record_borrow(u, b)
+    print(f"incremental borrow: {(time.perf_counter() - start) / 1000 * 1e3:8.3f} ms each")
+
+    probes = rng.integers(1, books + 1, size=10000).tolist()
+    start = time.perf_counter()
+    for b in probes:
+        index.similar(b, 10)
+    print(f"similar() read    : {(time.perf_counter() - start) / len(probes) * 1e6:8.2f} us each")
+
+    probes = rng.integers(1, users + 1, size=10000).tolist()
+    start = time.perf_counter()
+    for u in probes:
+        index.recommend_for_user(u, 10)
+    print(f"user recommend    : {(time.perf_counter() - start) / len(probes) * 1e6:8.2f} us each")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Admission control route classes.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+import support  # noqa: F401  (before any app module)
+
+from app.admission import classify
+from app.routers.users import create_access_token
+
+def bearer(**claims) -> dict[bytes, bytes]:
+    return {b"authorization": b"Bearer " + create_access_token({"sub": "u", **claims}).encode()}
+
+class ClassifyTest(unittest.TestCase):
+    def test_borrowing_writes_need_a_desk_or_admin_token(self):
+        path = "/api/borrowing/borrow"
+        self.assertEqual(classify("POST", path, bearer(role="desk")), "circulation")
+        self.assertEqual(classify("POST", path, bearer(role="admin")), "circulation")
+        self.assertEqual(classify("POST", path, bearer(role="member")), "write")
+        self.assertEqual(classify("POST", path, {}), "write")
+        self.assertEqual(classify("POST", path, {b"authorization": b"Bearer forged"}), "write")
+
+    def test_other_classes(self):
+        self.assertEqual(classify("GET", "/api/borrowing/", bearer(role="desk")), "read")
+        self.assertEqual(classify("POST", "/api/books/", bearer(role="admin")), "write")
+        self.assertEqual(classify("PUT", "/api/users/me/avatar", {}), "upload")
+        self.assertIsNone(classify("GET", "/api/health", {}))
+
+if __name__ == "__main__":
+    unittest.main()
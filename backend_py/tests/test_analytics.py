@@ -0,0 +1,85 @@
+"""Top-book reports: the monthly rollup plus daily edges must match the daily rows.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import random
+import unittest
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import support
+
+from app import analytics, models
+from app.db import SessionLocal
+
+def brute_force(loans, start: date, end: date, limit: int, by: str) -> list[tuple]:
+    totals = defaultdict(lambda: [0, 0])
+    for book_id, borrowed_at, returned_at in loans:
+        if start <= borrowed_at.date() <= end:
+            totals[book_id][0] += 1
+        if returned_at and start <= returned_at.date() <= end:
+            totals[book_id][1] += 1
+    i = 1 if by == "returns" else 0
+    ranked = sorted(totals.items(), key=lambda kv: (-kv[1][i], kv[0]))
+    return [(book_id, b, r) for book_id, (b, r) in ranked if b or r][:limit]
+
+class TopBooksTest(unittest.TestCase):
+    RANGES = [
+        (date(2025, 1, 1), date(2025, 12, 31)),  # whole months only
+        (date(2025, 1, 15), date(2025, 3, 10)),  # partial months at both ends
+        (date(2025, 2, 3), date(2025, 2, 20)),  # inside one month
+        (date(2025, 11, 30), date(2026, 2, 1)),  # across a year end
+        (date(2025, 6, 1), date(2025, 6, 30)),
+        (date(2025, 6, 1), date(2025, 6, 29)),
+        (date(2025, 6, 2), date(2025, 6, 30)),
+        (date(2025, 7, 4), date(2025, 7, 4)),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        support.reset()
+        rng = random.Random(3)
+        cls.loans = []
+        origin = datetime(2024, 12, 1)
+        for _ in range(3000):
+            borrowed_at = origin + timedelta(minutes=rng.randrange(60 * 24 * 450))
+            returned_at = borrowed_at + timedelta(hours=rng.randrange(1, 24 * 40)) if rng.random() < 0.8 else None
+            cls.loans.append((rng.randint(1, 60), borrowed_at, returned_at))
+        db = SessionLocal()
+        try:
+            analytics.record(
+                db,
+                borrows=[(b, "fiction", at) for b, at, _ in cls.loans],
+                returns=[(b, "fiction", at, back) for b, at, back in cls.loans if back],
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def setUp(self):
+        self.db = SessionLocal()
+
+    def tearDown(self):
+        self.db.close()
+
+    def top(self, start: date, end: date, limit: int, by: str) -> list[tuple]:
+        return [(r["book_id"], r["borrows"], r["returns"]) for r in analytics.top_books(self.db, start, end, limit, by)]
+
+    def test_matches_brute_force(self):
+        for start, end in self.RANGES:
+            for by in ("borrows", "returns"):
+                self.assertEqual(self.top(start, end, 15, by), brute_force(self.loans, start, end, 15, by), (start, end, by))
+
+    def test_fill_monthly_rebuilds_the_monthly_rollup(self):
+        m = models.MonthlyBookCirculation
+        before = sorted(tuple(r) for r in self.db.query(m.month, m.book_id, m.borrows, m.returns, m.loan_seconds))
+        self.db.query(m).delete()
+        analytics.fill_monthly(self.db)
+        after = sorted(tuple(r) for r in self.db.query(m.month, m.book_id, m.borrows, m.returns, m.loan_seconds))
+        self.db.rollback()
+        self.assertEqual(after, before)
+
+if __name__ == "__main__":
+    unittest.main()
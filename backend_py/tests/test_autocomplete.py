@@ -0,0 +1,73 @@
+"""Autocomplete ordering: snapshot, delta and a brute-force scan must agree.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import random
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  (before any app module)
+
+from app import autocomplete
+from app.autocomplete import AUTHOR, TITLE, AutocompleteIndex, normalize
+
+# accents are stripped by normalize(); Greek, Cyrillic and CJK stay multi-byte
+WORDS = ["harbor", "harbour", "lights", "über", "café", "north", "tide", "saga", "ωμέγα", "книга", "東京"]
+
+def _docs(n: int, seed: int = 7) -> list[tuple[int, str, str]]:
+    rng = random.Random(seed)
+    ids = rng.sample(range(1, 10 * n), n)  # key order differs from id order
+    docs = []
+    for book_id in ids:
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        if rng.random() < 0.1:
+            title += " " + "x" * 70  # longer than the rank byte can tell apart
+        docs.append((book_id, title, rng.choice(["Ana Harbor", "Zoë Tide", "Li Saga", "Émile North"])))
+    return docs
+
+def brute_force(docs, q: str, limit: int) -> list[tuple[int, int]]:
+    prefix = normalize(q).encode("utf-8")
+    ranked = []
+    for book_id, title, author in docs:
+        for kind, text in ((TITLE, normalize(title)), (AUTHOR, normalize(author))):
+            data = text.encode("utf-8")
+            for i in range(len(data)):
+                if (i == 0 or data[i - 1] == 0x20) and data[i:].startswith(prefix):
+                    ranked.append((autocomplete._rank(kind, i > 0, len(data), book_id), book_id, kind))
+    seen = {}
+    for _, book_id, kind in sorted(ranked):
+        if len(seen) < limit and book_id not in seen:
+            seen[book_id] = kind
+    return list(seen.items())
+
+class AutocompleteOrderTest(unittest.TestCase):
+    QUERIES = ["h", "ha", "har", "harb", "harbo", "über", "uber", "cafe l", "saga t", "ωμ", "книга", "東", "zoe"]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.docs = _docs(600)
+        cls.snapshot = AutocompleteIndex()
+        cls.snapshot.build(cls.docs)
+        cls.delta = AutocompleteIndex()
+        with mock.patch.object(autocomplete, "DELTA_LIMIT", len(cls.docs) + 1):
+            for doc in cls.docs:
+                cls.delta.add(*doc)
+
+    def test_snapshot_and_delta_match_brute_force(self):
+        for q in self.QUERIES:
+            for limit in (5, 20, 32):
+                expected = brute_force(self.docs, q, limit)
+                self.assertEqual(self.snapshot.suggest(q, limit), expected, (q, limit, "snapshot"))
+                self.assertEqual(self.delta.suggest(q, limit), expected, (q, limit, "delta"))
+
+    def test_ties_break_on_book_id(self):
+        index = AutocompleteIndex()
+        # same kind and length; key order (by title) is the reverse of id order
+        docs = [(100 - n, f"tied {chr(97 + n // 26)}{chr(97 + n % 26)}", "") for n in range(40)]
+        index.build(docs)
+        self.assertEqual([b for b, _ in index.suggest("tied", 10)], sorted(b for b, _, _ in docs)[:10])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Batch checkout and check-in: partial failures, duplicate ids, hold handoff.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+import support
+
+from app import models
+from app.db import SessionLocal
+
+class BatchCirculationTest(unittest.TestCase):
+    def setUp(self):
+        support.reset()
+        self.client = support.client()
+        self.ann, self.bob = support.add_user("ann"), support.add_user("bob")
+
+    def borrow_batch(self, user_id: int, book_ids: list[int]) -> dict:
+        response = self.client.post("/api/borrowing/borrow/batch", json={"user_id": user_id, "book_ids": book_ids})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def return_batch(self, borrow_ids: list[int]) -> dict:
+        response = self.client.put("/api/borrowing/return/batch", json={"borrow_ids": borrow_ids})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def details(self, result: dict) -> list[tuple]:
+        return [(r["id"], r["success"], r["detail"]) for r in result["results"]]
+
+    def loans(self, user_id: int) -> list[dict]:
+        return self.client.get(f"/api/borrowing/user/{user_id}").json()
+
+    def available(self, book_id: int) -> bool:
+        return self.client.get(f"/api/books/{book_id}").json()["available"]
+
+    def test_checkout_reports_each_failure_and_keeps_the_rest(self):
+        free, out, mine = support.add_book("Free"), support.add_book("Out", available=False), support.add_book("Mine")
+        self.borrow_batch(self.ann, [mine])
+
+        result = self.borrow_batch(self.ann, [free, out, 9999, mine])
+        self.assertEqual((result["succeeded"], result["failed"]), (1, 3))
+        self.assertEqual(self.details(result), [
+            (free, True, None),
+            (out, False, "Book not available"),
+            (9999, False, "Book not available"),
+            (mine, False, "Book already borrowed by this user"),
+        ])
+        self.assertEqual(sorted(l["book_id"] for l in self.loans(self.ann)), sorted([free, mine]))
+        self.assertFalse(self.available(free))
+
+    def test_checkout_collapses_duplicate_ids(self):
+        first, second = support.add_book("First"), support.add_book("Second")
+        result = self.borrow_batch(self.ann, [first, first, second, first])
+        self.assertEqual([r["id"] for r in result["results"]], [first, second])
+        self.assertEqual(result["succeeded"], 2)
+        self.assertEqual(len(self.loans(self.ann)), 2)
+
+    def test_checkin_reports_each_failure_and_collapses_duplicates(self):
+        books = [support.add_book("One"), support.add_book("Two")]
+        loan_ids = [r["borrow_id"] for r in self.borrow_batch(self.ann, books)["results"]]
+        self.return_batch(loan_ids[:1])
+
+        result = self.return_batch([loan_ids[1], loan_ids[1], loan_ids[0], 9999])
+        self.assertEqual(self.details(result), [
+            (loan_ids[1], True, None),
+            (loan_ids[0], False, "Book already returned"),
+            (9999, False, "Borrowing record not found"),
+        ])
+        self.assertEqual([l["status"] for l in self.loans(self.ann)], ["returned", "returned"])
+        self.assertTrue(all(self.available(b) for b in books))
+
+    def test_checkin_hands_held_copies_to_the_queue(self):
+        held, free = support.add_book("Held"), support.add_book("Free")
+        loan_ids = [r["borrow_id"] for r in self.borrow_batch(self.ann, [held, free])["results"]]
+        hold = self.client.post("/api/borrowing/holds", json={"user_id": self.bob, "book_id": held}).json()
+
+        result = self.return_batch(loan_ids)
+        self.assertEqual(result["succeeded"], 2)
+        hold = self.client.get(f"/api/borrowing/holds/{hold['id']}").json()
+        self.assertEqual(hold["status"], "fulfilled")
+        self.assertEqual([(l["id"], l["book_id"]) for l in self.loans(self.bob)], [(hold["borrow_id"], held)])
+        self.assertFalse(self.available(held))
+        self.assertTrue(self.available(free))
+
+        db = SessionLocal()
+        try:
+            borrows = dict(db.query(models.DailyBookCirculation.book_id, models.DailyBookCirculation.borrows))
+        finally:
+            db.close()
+        # ann's checkout plus bob's handoff
+        self.assertEqual(borrows, {held: 2, free: 1})
+
+if __name__ == "__main__":
+    unittest.main()
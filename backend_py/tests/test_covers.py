@@ -0,0 +1,138 @@
+"""Cover cache against a local stand-in image server.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import asyncio
+import io
+import ipaddress
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from PIL import Image
+
+from app import covers
+
+def _png(width: int, height: int, mode: str = "RGB") -> bytes:
+    out = io.BytesIO()
+    Image.new(mode, (width, height)).save(out, "PNG")
+    return out.getvalue()
+
+COVER = _png(600, 900)
+# tiny on the wire, far past Pillow's decompression bomb limit once opened
+BOMB = _png(20_000, 20_000, mode="1")
+
+class StandIn(BaseHTTPRequestHandler):
+    hits: dict[str, int] = {}
+
+    def do_GET(self):
+        StandIn.hits[self.path] = StandIn.hits.get(self.path, 0) + 1
+        port = self.server.server_address[1]
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", f"http://127.0.0.1:{port}/cover.png")
+            self.end_headers()
+            return
+        content_type, body = {
+            "/cover.png": ("image/png", COVER),
+            "/bomb.png": ("image/png", BOMB),
+            "/page": ("text/html", b"<html>internal admin page</html>"),
+            "/fake.png": ("image/png", b"<html>not an image</html>"),
+        }.get(self.path, ("text/plain", b"not found"))
+        self.send_response(200 if body != b"not found" else 404)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class CoverCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        cls.port = cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StandIn.hits.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = covers.CoverCache(self.tmp.name, max_bytes=10 * 2**20)
+        # the stand-in is reachable by name only; 127.0.0.1 itself stays refused
+        patcher = mock.patch.object(covers, "ALLOWED_HOSTS", frozenset({"localhost"}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def url(self, path: str, host: str = "localhost") -> str:
+        return f"http://{host}:{self.port}{path}"
+
+    def test_private_addresses_are_not_public(self):
+        for ip in ("127.0.0.1", "10.1.2.3", "172.16.0.1", "192.168.1.1", "169.254.169.254",
+                   "0.0.0.0", "::1", "fe80::1", "fd00::1", "::ffff:127.0.0.1", "224.0.0.1"):
+            self.assertFalse(covers.is_public_address(ipaddress.ip_address(ip)), ip)
+        for ip in ("93.184.216.34", "2606:4700::1111"):
+            self.assertTrue(covers.is_public_address(ipaddress.ip_address(ip)), ip)
+
+    def test_loopback_is_refused(self):
+        with self.assertRaises(covers.CoverFetchError):
+            covers.fetch_remote(self.url("/cover.png", host="127.0.0.1"))
+        self.assertEqual(StandIn.hits, {})
+
+    def test_redirect_to_loopback_is_refused(self):
+        with self.assertRaises(covers.CoverFetchError):
+            covers.fetch_remote(self.url("/redirect"))
+        self.assertEqual(StandIn.hits, {"/redirect": 1})
+
+    def test_non_images_are_not_stored(self):
+        for path in ("/page", "/fake.png"):
+            with self.assertRaises(covers.CoverFetchError):
+                asyncio.run(self.cache.get(self.url(path), 320, "jpeg"))
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_decompression_bomb_is_a_fetch_error(self):
+        with self.assertRaises(covers.CoverFetchError):
+            asyncio.run(self.cache.get(self.url("/bomb.png"), 320, "jpeg"))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        async def burst():
+            return await asyncio.gather(*(self.cache.read(self.url("/cover.png"), 320, "webp") for _ in range(20)))
+
+        results = asyncio.run(burst())
+        self.assertEqual(StandIn.hits, {"/cover.png": 1})
+        data, media_type = results[0]
+        self.assertEqual(media_type, "image/webp")
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.size, (320, 480))
+
+    def test_variant_evicted_before_read_is_rebuilt(self):
+        url = self.url("/cover.png")
+        real_get = self.cache.get
+        paths = []
+
+        async def racing_get(*args):
+            path, media_type = await real_get(*args)
+            if not paths:
+                os.remove(path)  # evicted between lookup and read
+            paths.append(path)
+            return path, media_type
+
+        with mock.patch.object(self.cache, "get", racing_get):
+            data, media_type = asyncio.run(self.cache.read(url, 160, "jpeg"))
+        self.assertEqual(len(paths), 2)
+        self.assertEqual((data[:3], media_type), (b"\xff\xd8\xff", "image/jpeg"))
+        self.assertEqual(StandIn.hits, {"/cover.png": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Integration tests against a real server database.
+
+Skipped unless `TEST_DATABASE_URL` names a scratch PostgreSQL database, which
+they alter and empty. Run from backend_py/:
+
+    TEST_DATABASE_URL=postgresql://localhost/libraryhub_test python -m unittest discover tests
+"""
+import itertools
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+import support
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app import analytics, db as database, models
+from app.db import DEFAULT_BRANCH, RecentWriters, SessionLocal, engine, get_db, get_read_db
+from app.routers.users import create_access_token
+
+@unittest.skipUnless(support.TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class PostgresTest(unittest.TestCase):
+    def setUp(self):
+        support.reset()
+
+    def test_engine_uses_psycopg2_with_a_pool(self):
+        self.assertEqual((engine.dialect.name, engine.dialect.driver), ("postgresql", "psycopg2"))
+        self.assertEqual(engine.pool.size(), database.DB_POOL_SIZE)
+        self.assertTrue(engine.pool._pre_ping)
+
+    def test_missing_nullable_columns_are_added_in_place(self):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE books DROP COLUMN isbn13"))
+        database._add_missing_columns(DEFAULT_BRANCH)
+        inspector = inspect(engine)
+        self.assertIn("isbn13", {c["name"] for c in inspector.get_columns("books")})
+        self.assertIn("isbn13", {c for i in inspector.get_indexes("books") for c in i["column_names"]})
+
+    def test_missing_required_columns_stop_startup(self):
+        table = models.DailyCirculation.__table__
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE stats_daily DROP COLUMN borrows"))
+        try:
+            with self.assertRaisesRegex(RuntimeError, "stats_daily.borrows"):
+                database._add_missing_columns(DEFAULT_BRANCH)
+        finally:
+            table.drop(bind=engine)
+            table.create(bind=engine)
+
+    def test_rollup_upserts_add_onto_existing_rows(self):
+        at = datetime(2026, 3, 1, 10)
+        db = SessionLocal()
+        try:
+            analytics.record(db, borrows=[(1, "fiction", at), (2, None, at)])
+            db.commit()
+            analytics.record(db, borrows=[(1, "fiction", at)], returns=[(1, "fiction", at - timedelta(days=2), at)])
+            db.commit()
+            m = models.DailyBookCirculation
+            rows = db.query(m.book_id, m.borrows, m.returns, m.loan_seconds).order_by(m.book_id).all()
+            self.assertEqual([tuple(r) for r in rows], [(1, 2, 1, 2 * 86400), (2, 1, 0, 0)])
+            self.assertEqual(db.get(models.DailyCirculation, date(2026, 3, 1)).borrows, 3)
+            self.assertEqual(db.get(models.DailyCategoryCirculation, (date(2026, 3, 1), "uncategorized")).borrows, 1)
+        finally:
+            db.close()
+
+@unittest.skipUnless(support.TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class ReadYourWritesTest(unittest.TestCase):
+    """Routes on a replica pool whose only replica is a second engine on the same database"""
+
+    def setUp(self):
+        support.reset()
+        self.replica = database._make_engine(support.TEST_DATABASE_URL)
+        replicas = {DEFAULT_BRANCH: itertools.cycle([database._sessionmaker(self.replica, DEFAULT_BRANCH, replica=True)])}
+        self.writers = RecentWriters(window=60)
+        for patch in (
+            mock.patch.object(database, "_replica_sessions", replicas),
+            mock.patch.object(database, "recent_writers", self.writers),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.replica.dispose)
+
+        app = FastAPI()
+
+        @app.get("/read")
+        def read(db: Session = Depends(get_read_db)):
+            return {"replica": db.info["replica"]}
+
+        @app.post("/write")
+        def write(db: Session = Depends(get_db)):
+            return {"replica": db.info["replica"]}
+
+        self.client = TestClient(app)
+
+    def test_reads_use_the_replica_until_the_client_writes(self):
+        ann = {"Authorization": "Bearer ann"}
+        self.assertTrue(self.client.get("/read", headers=ann).json()["replica"])
+        self.assertFalse(self.client.post("/write", headers=ann).json()["replica"])
+        self.assertFalse(self.client.get("/read", headers=ann).json()["replica"])
+        # other clients are not pinned by ann's write
+        self.assertTrue(self.client.get("/read", headers={"Authorization": "Bearer bob"}).json()["replica"])
+
+        self.writers.window = 0
+        self.client.post("/write", headers=ann)
+        self.assertTrue(self.client.get("/read", headers=ann).json()["replica"])
+
+    def test_wishlist_reads_stay_off_the_primary(self):
+        user_id = support.add_user("ann")
+        book_id = support.add_book("Wanted")
+        db = SessionLocal()
+        db.add(models.Wishlist(user_id=user_id, book_id=book_id, book_title="Wanted", book_author="a"))
+        db.commit()
+        db.close()
+        headers = {"Authorization": "Bearer " + create_access_token({"sub": "ann", "branch": DEFAULT_BRANCH})}
+
+        checkouts = []
+        listener = lambda *args: checkouts.append(1)  # noqa: E731
+        event.listen(engine, "checkout", listener)
+        self.addCleanup(event.remove, engine, "checkout", listener)
+        client = support.client()
+        wishlist = client.get("/api/users/wishlist", headers=headers).json()["wishlist"]
+        self.assertEqual([w["book_id"] for w in wishlist], [book_id])
+        self.assertTrue(client.get(f"/api/users/wishlist/check/{book_id}", headers=headers).json()["in_wishlist"])
+        self.assertEqual(checkouts, [])
+
+if __name__ == "__main__":
+    unittest.main()
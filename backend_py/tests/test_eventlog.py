@@ -0,0 +1,47 @@
+"""Event log queueing: back-pressure instead of drops, and connection hand-back.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import threading
+import unittest
+from unittest import mock
+
+import support
+
+from app import eventlog, models
+from app.db import SessionLocal
+from app.eventlog import EventLog, event
+
+class EventLogQueueTest(unittest.TestCase):
+    def test_full_buffered_queue_blocks_instead_of_dropping(self):
+        log = EventLog(max_queue=1, durability="buffered")
+        log._thread = threading.current_thread()  # no writer: the test drains the queue
+        log.append("main", [event("a")])
+
+        second = threading.Thread(target=log.append, args=("main", [event("b")]))
+        second.start()
+        second.join(0.2)
+        self.assertTrue(second.is_alive())
+        self.assertEqual(log._queue.get()[1][0]["type"], "a")
+        second.join(2)
+        self.assertFalse(second.is_alive())
+        self.assertEqual(log._queue.get()[1][0]["type"], "b")
+        self.assertEqual(log.stats()["waited"], 1)
+
+    def test_emit_returns_the_connection_before_queueing(self):
+        support.reset()
+        db = SessionLocal()
+        try:
+            db.execute(models.Book.__table__.select())
+            self.assertTrue(db.in_transaction())
+            seen = []
+            with mock.patch.object(eventlog.log, "append", lambda branch, rows: seen.append(db.in_transaction())):
+                eventlog.emit(db, [event("a")])
+            self.assertEqual(seen, [False])
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    unittest.main()
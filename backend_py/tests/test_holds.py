@@ -0,0 +1,119 @@
+"""FIFO hold queue handoff on return, batch return and manual availability.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+import support
+
+from app import models
+from app.db import SessionLocal
+from app.routers.borrowing import RESERVED
+
+class HoldQueueTest(unittest.TestCase):
+    def setUp(self):
+        support.reset()
+        self.client = support.client()
+        self.ann, self.bob, self.cat = (support.add_user(n) for n in ("ann", "bob", "cat"))
+
+    def borrow(self, user_id: int, book_id: int):
+        return self.client.post("/api/borrowing/borrow", json={
+            "user_id": user_id, "book_id": book_id, "book_title": "t", "book_author": "a",
+        })
+
+    def hold(self, user_id: int, book_id: int) -> dict:
+        response = self.client.post("/api/borrowing/holds", json={"user_id": user_id, "book_id": book_id})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def get_hold(self, hold_id: int) -> dict:
+        return self.client.get(f"/api/borrowing/holds/{hold_id}").json()
+
+    def available(self, book_id: int) -> bool:
+        return self.client.get(f"/api/books/{book_id}").json()["available"]
+
+    def loan_of(self, user_id: int, book_id: int) -> dict:
+        loans = self.client.get(f"/api/borrowing/user/{user_id}").json()
+        return next(l for l in loans if l["book_id"] == book_id and l["status"] == "borrowed")
+
+    def event_types(self) -> list[str]:
+        db = SessionLocal()
+        try:
+            return [t for (t,) in db.query(models.EventLogEntry.type).order_by(models.EventLogEntry.id)]
+        finally:
+            db.close()
+
+    def test_return_hands_the_copy_down_the_queue_in_order(self):
+        book = support.add_book("Queued")
+        loan = self.borrow(self.ann, book).json()
+        bob_hold, cat_hold = self.hold(self.bob, book), self.hold(self.cat, book)
+        self.assertEqual((bob_hold["position"], cat_hold["position"]), (1, 2))
+
+        response = self.client.put(f"/api/borrowing/return/{loan['id']}")
+        self.assertEqual(response.json()["status"], "returned")
+        bob_hold = self.get_hold(bob_hold["id"])
+        self.assertEqual(bob_hold["status"], "fulfilled")
+        self.assertEqual(bob_hold["borrow_id"], self.loan_of(self.bob, book)["id"])
+        self.assertEqual(self.get_hold(cat_hold["id"])["position"], 1)
+        self.assertFalse(self.available(book))
+
+        self.client.put(f"/api/borrowing/return/{bob_hold['borrow_id']}")
+        self.assertEqual(self.get_hold(cat_hold["id"])["status"], "fulfilled")
+        self.client.put(f"/api/borrowing/return/{self.loan_of(self.cat, book)['id']}")
+        self.assertTrue(self.available(book))
+        self.assertEqual(self.event_types().count("hold.fulfilled"), 2)
+
+    def test_batch_return_hands_each_copy_to_its_queue_head(self):
+        queued, shelved = support.add_book("Queued"), support.add_book("Shelved")
+        loans = self.client.post("/api/borrowing/borrow/batch", json={
+            "user_id": self.ann, "book_ids": [queued, shelved],
+        }).json()["results"]
+        bob_hold, cat_hold = self.hold(self.bob, queued), self.hold(self.cat, queued)
+
+        result = self.client.put("/api/borrowing/return/batch", json={
+            "borrow_ids": [r["borrow_id"] for r in loans],
+        }).json()
+        self.assertEqual(result["succeeded"], 2)
+        self.assertEqual(self.get_hold(bob_hold["id"])["borrow_id"], self.loan_of(self.bob, queued)["id"])
+        self.assertEqual(self.get_hold(cat_hold["id"])["position"], 1)
+        self.assertFalse(self.available(queued))
+        self.assertTrue(self.available(shelved))
+
+    def test_only_the_queue_head_may_borrow_a_held_copy(self):
+        book = support.add_book("Queued")
+        self.borrow(self.ann, book)
+        bob_hold = self.hold(self.bob, book)
+        # a copy left available while someone waits, e.g. from before holds existed
+        db = SessionLocal()
+        db.query(models.Book).filter(models.Book.id == book).update({"available": True})
+        db.commit()
+        db.close()
+
+        response = self.borrow(self.cat, book)
+        self.assertEqual((response.status_code, response.json()["detail"]), (400, RESERVED))
+        batch = self.client.post("/api/borrowing/borrow/batch", json={"user_id": self.cat, "book_ids": [book]})
+        self.assertEqual(batch.json()["results"][0]["detail"], RESERVED)
+
+        response = self.borrow(self.bob, book)
+        self.assertEqual(response.status_code, 200, response.text)
+        bob_hold = self.get_hold(bob_hold["id"])
+        self.assertEqual((bob_hold["status"], bob_hold["borrow_id"]), ("fulfilled", response.json()["id"]))
+
+    def test_marking_a_book_available_serves_the_queue_first(self):
+        book = support.add_book("Lost and found")
+        self.borrow(self.ann, book)
+        bob_hold = self.hold(self.bob, book)
+
+        response = self.client.put(f"/api/books/{book}", json={
+            "title": "Lost and found", "author": "Test Author", "category": "fiction", "available": True,
+        })
+        self.assertFalse(response.json()["available"])
+        bob_hold = self.get_hold(bob_hold["id"])
+        self.assertEqual(bob_hold["status"], "fulfilled")
+        self.assertEqual(bob_hold["borrow_id"], self.loan_of(self.bob, book)["id"])
+        self.assertEqual(self.event_types()[-2:], ["hold.fulfilled", "loan.borrowed"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""ISBN normalization and the duplicate-book merge.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import unittest
+from datetime import date, datetime
+
+import support
+
+from app import models
+from app.db import SessionLocal
+from app.eventlog import event
+from app.isbn import InvalidISBN, merge_duplicates, normalize_isbn, try_normalize_isbn
+
+class NormalizeISBNTest(unittest.TestCase):
+    def test_isbn10_becomes_isbn13(self):
+        self.assertEqual(normalize_isbn("0-306-40615-2"), "9780306406157")
+        self.assertEqual(normalize_isbn("ISBN 0 8044 2957 x"), "9780804429573")
+
+    def test_isbn13_keeps_its_digits(self):
+        for raw in ("978-0-306-40615-7", "isbn:9780306406157", "979-10-90636-07-1"):
+            self.assertEqual(normalize_isbn(raw), raw.upper().replace("ISBN:", "").replace("-", ""))
+
+    def test_bad_checksums_are_rejected(self):
+        for raw in ("0306406153", "9780306406158", "9770306406155", "030640615X"):
+            with self.assertRaises(InvalidISBN, msg=raw):
+                normalize_isbn(raw)
+
+    def test_non_ascii_digits_are_rejected(self):
+        # "²", Arabic-Indic and fullwidth digits all pass str.isdigit()
+        for raw in ("03064061²2", "٠٣٠٦٤٠٦١٥٢", "０３０６４０６１５２"):
+            with self.assertRaises(InvalidISBN, msg=raw):
+                normalize_isbn(raw)
+            self.assertIsNone(try_normalize_isbn(raw))
+
+    def test_try_normalize_returns_none_for_junk(self):
+        self.assertIsNone(try_normalize_isbn(None))
+        self.assertIsNone(try_normalize_isbn(""))
+        self.assertIsNone(try_normalize_isbn("not an isbn"))
+
+class MergeDuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        support.reset()
+        self.ann, self.bob = support.add_user("ann"), support.add_user("bob")
+        self.keep = support.add_book("Keep", isbn="0-306-40615-2")
+        self.dup = support.add_book("Dup", available=False, isbn="978 0306 406157")
+        self.other = support.add_book("Other", isbn="9780804429573")
+        self.bad = support.add_book("Bad", isbn="0306406153")
+
+        db = SessionLocal()
+        day, other_day = date(2026, 3, 1), date(2026, 3, 2)
+        db.add_all([
+            models.Borrowing(user_id=self.ann, book_id=self.dup, book_title="Dup", book_author="a",
+                             status="borrowed"),
+            models.Wishlist(user_id=self.bob, book_id=self.keep, book_title="Keep", book_author="a"),
+            models.Wishlist(user_id=self.bob, book_id=self.dup, book_title="Dup", book_author="a"),
+            models.Hold(user_id=self.bob, book_id=self.keep),
+            models.Hold(user_id=self.bob, book_id=self.dup),
+            models.DailyBookCirculation(day=day, book_id=self.keep, borrows=2, returns=1, loan_seconds=60),
+            models.DailyBookCirculation(day=day, book_id=self.dup, borrows=3, returns=2, loan_seconds=40),
+            models.DailyBookCirculation(day=other_day, book_id=self.dup, borrows=1, returns=0, loan_seconds=0),
+            models.MonthlyBookCirculation(month=day, book_id=self.keep, borrows=2, returns=1, loan_seconds=60),
+            models.MonthlyBookCirculation(month=day, book_id=self.dup, borrows=4, returns=2, loan_seconds=40),
+        ])
+        db.flush()
+        db.execute(models.EventLogEntry.__table__.insert(), [
+            event("loan.borrowed", user_id=self.ann, book_id=self.dup, ts=datetime(2026, 3, 1)),
+        ])
+        db.commit()
+        db.close()
+        self.db = SessionLocal()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_dry_run_reports_without_writing(self):
+        report = merge_duplicates(self.db, dry_run=True)
+        self.assertEqual(report["merged"], {self.dup: self.keep})
+        self.assertEqual(report["invalid_isbn_ids"], [self.bad])
+        self.assertIsNotNone(self.db.get(models.Book, self.dup))
+
+    def test_merge_moves_every_reference_to_the_survivor(self):
+        report = merge_duplicates(self.db)
+        self.assertEqual((report["duplicate_groups"], report["merged"]), (1, {self.dup: self.keep}))
+        db = self.db
+        self.assertIsNone(db.get(models.Book, self.dup))
+        keep = db.get(models.Book, self.keep)
+        self.assertEqual(keep.isbn13, "9780306406157")
+        self.assertFalse(keep.available)  # the merged copy is on loan
+        self.assertEqual(db.get(models.Book, self.other).isbn13, "9780804429573")
+        self.assertIsNone(db.get(models.Book, self.bad).isbn13)
+
+        self.assertEqual([b.book_id for b in db.query(models.Borrowing)], [self.keep])
+        self.assertEqual([w.book_id for w in db.query(models.Wishlist)], [self.keep])
+        holds = db.query(models.Hold).order_by(models.Hold.id).all()
+        self.assertEqual([(h.book_id, h.status) for h in holds], [(self.keep, "waiting"), (self.keep, "cancelled")])
+
+        m = models.DailyBookCirculation
+        rows = db.query(m.day, m.book_id, m.borrows, m.returns, m.loan_seconds).order_by(m.day).all()
+        self.assertEqual([tuple(r) for r in rows], [
+            (date(2026, 3, 1), self.keep, 5, 3, 100),
+            (date(2026, 3, 2), self.keep, 1, 0, 0),
+        ])
+        m = models.MonthlyBookCirculation
+        rows = db.query(m.month, m.book_id, m.borrows, m.returns, m.loan_seconds).all()
+        self.assertEqual([tuple(r) for r in rows], [(date(2026, 3, 1), self.keep, 6, 3, 100)])
+
+        log = db.query(models.EventLogEntry).order_by(models.EventLogEntry.id).all()
+        self.assertEqual([(e.type, e.book_id, e.ref_id) for e in log], [
+            ("loan.borrowed", self.keep, None),
+            ("book.merged", self.keep, self.dup),
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
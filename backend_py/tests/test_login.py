@@ -0,0 +1,73 @@
+"""Login throttling: per-address and per-account buckets, known addresses, proxies.
+
+Run from backend_py/:
+
+    python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+import support
+
+from app import security
+from app.routers import users
+from app.security import KnownLogins, TokenBucketLimiter
+
+class LoginThrottleTest(unittest.TestCase):
+    def setUp(self):
+        support.reset()
+        support.add_user("ann", password="secret")
+        self.client = support.client()
+        # fresh buckets that barely refill during a test
+        for name, limiter in (
+            ("ip_limiter", TokenBucketLimiter(rate=0.001, capacity=5)),
+            ("username_limiter", TokenBucketLimiter(rate=0.001, capacity=3)),
+            ("known_logins", KnownLogins()),
+        ):
+            patcher = mock.patch.object(users, name, limiter)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # the test client's peer is a proxy, so each request can name its client
+        patcher = mock.patch.object(security, "TRUSTED_PROXIES", frozenset({"testclient"}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, password: str, ip: str, username: str = "ann"):
+        return self.client.post(
+            "/api/users/login",
+            data={"username": username, "password": password},
+            # the leftmost hop is client supplied and must not count
+            headers={"X-Forwarded-For": f"203.0.113.250, {ip}"},
+        )
+
+    def test_successful_logins_cost_no_tokens(self):
+        for _ in range(10):
+            self.assertEqual(self.login("secret", "198.51.100.7").status_code, 200)
+
+    def test_failures_from_one_address_are_throttled(self):
+        for n in range(5):
+            self.assertEqual(self.login("wrong", "198.51.100.7", username=f"nobody{n}").status_code, 401)
+        response = self.login("secret", "198.51.100.7")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers["Retry-After"]), 0)
+        # other clients behind the same proxy are not affected
+        self.assertEqual(self.login("secret", "198.51.100.8").status_code, 200)
+
+    def test_account_bucket_spans_addresses_but_spares_known_ones(self):
+        self.assertEqual(self.login("secret", "203.0.113.1").status_code, 200)
+        for n in range(3):
+            self.assertEqual(self.login("wrong", f"192.0.2.{n}").status_code, 401)
+        response = self.login("wrong", "192.0.2.99")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response.headers)
+        # the owner's usual address still gets in
+        self.assertEqual(self.login("secret", "203.0.113.1").status_code, 200)
+
+    def test_forwarded_for_is_ignored_from_untrusted_peers(self):
+        with mock.patch.object(security, "TRUSTED_PROXIES", frozenset()):
+            for n in range(5):
+                self.login("wrong", f"192.0.2.{n}", username=f"nobody{n}")
+            self.assertEqual(self.login("secret", "192.0.2.200").status_code, 429)
+
+if __name__ == "__main__":
+    unittest.main()